@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the Rhythmbox Desktop Art plug-in
+#
+# Copyright © 2008 Mathias Nedrebø < mathias at nedrebo dot org >
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+from __future__ import division
+
+import gconf
+import gobject
+
+def get_value(val):
+    if val.type == gconf.VALUE_FLOAT:
+        return val.get_float()
+    elif val.type == gconf.VALUE_INT:
+        return val.get_int()
+    elif val.type == gconf.VALUE_STRING:
+        return val.get_string()
+    elif val.type == gconf.VALUE_BOOL:
+        return val.get_bool()
+    return None
+
+class Config():
+    # The plugin's gconf keys, loaded with one directory fetch and shared by
+    # all components. Colour strings are also kept parsed, as key_r, key_g,
+    # key_b and key_a. Changes are collected and applied together from an
+    # idle callback, which then calls every subscriber once with the set of
+    # its keys that changed.
+    def __init__(self, dir_path):
+        self.dir_path = dir_path
+        self.values = {}
+        self.pending = {}
+        self.subscribers = []
+        self.source = None
+        self.gc = gconf.client_get_default()
+        self.gc.add_dir(dir_path, gconf.CLIENT_PRELOAD_ONELEVEL)
+        for entry in self.gc.all_entries(dir_path):
+            if entry.get_value():
+                self.set_value(entry.get_key().split('/')[-1], get_value(entry.get_value()))
+        self.notify_id = self.gc.notify_add(dir_path, self.notify)
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def __contains__(self, key):
+        return key in self.values
+
+    def set_value(self, key, value):
+        self.values[key] = value
+        # Parse color strings
+        if 'color' in key and value:
+            self.values['%s_r' % key] = int(value[ 1: 5], 16) / int('ffff', 16)
+            self.values['%s_g' % key] = int(value[ 5: 9], 16) / int('ffff', 16)
+            self.values['%s_b' % key] = int(value[ 9:13], 16) / int('ffff', 16)
+            self.values['%s_a' % key] = int(value[13:17], 16) / int('ffff', 16)
+
+    def subscribe(self, keys, callback):
+        self.subscribers.append((set(keys), callback))
+
+    def unsubscribe(self, callback):
+        self.subscribers = [s for s in self.subscribers if s[1] != callback]
+
+    def set(self, key, value):
+        # Change a value in memory only, e.g. to preview it before it is
+        # written to gconf
+        self.pending[key] = value
+        if not self.source:
+            self.source = gobject.idle_add(self.apply)
+
+    def notify(self, client, cnxn_id, entry, data=None):
+        if entry.get_value():
+            self.set(entry.get_key().split('/')[-1], get_value(entry.get_value()))
+
+    def apply(self):
+        self.source = None
+        changed = set()
+        for key, value in self.pending.items():
+            if self.values.get(key) != value:
+                self.set_value(key, value)
+                changed.add(key)
+        self.pending.clear()
+        for keys, callback in self.subscribers:
+            if keys & changed:
+                callback(keys & changed)
+        return False
+
+    def close(self):
+        if self.source:
+            gobject.source_remove(self.source)
+            self.source = None
+        self.gc.notify_remove(self.notify_id)
+        self.gc.remove_dir(self.dir_path)
+        self.subscribers = []
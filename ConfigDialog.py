@@ -20,6 +20,7 @@
 
 import gtk, gtk.glade
 import gconf
+import gobject
 
 widget_names = ['main_area',
                 'roundness',
@@ -28,6 +29,9 @@ widget_names = ['main_area',
                 'window_x', 'window_y', 'window_w', 'window_h',
                 'text_position_nw', 'text_position_ne', 'text_position_sw', 'text_position_se']
 
+# ms a value has to stay unchanged before it is written to gconf
+WRITE_DELAY = 500
+
 class ConfigDialog(gtk.Dialog):
     def __init__(self, glade_file, gconf_plugin_path, desktop_control):
         gtk.Dialog.__init__(self, buttons=(gtk.STOCK_OK, gtk.RESPONSE_ACCEPT))
@@ -36,8 +40,11 @@ class ConfigDialog(gtk.Dialog):
 
         self.connect("response", lambda w, e: w.hide())
         self.connect("response", lambda w, e: self.desktop_control.set_draw_border(False))
+        self.connect("response", lambda w, e: self.write_pending())
 
         self.gc = gconf.client_get_default()
+        self.pending = {}
+        self.write_source = None
 
         self.widgets = {}
         self.get_widgets(self.widgets, glade_file)
@@ -88,20 +95,38 @@ class ConfigDialog(gtk.Dialog):
                 w[name].set_alpha(a)
 
     def set_gconf_value(self, w, key):
+        # Shown by the widget at once, written to gconf when the value has
+        # settled or the dialog is closed
         if isinstance(w, gtk.SpinButton):
             if w.get_digits() == 0:
-                self.gc.set_int(self.gconf_path(key), int(w.get_value()))
+                value = (self.gc.set_int, int(w.get_value()))
             else:
-                self.gc.set_float(self.gconf_path(key), w.get_value())
+                value = (self.gc.set_float, w.get_value())
         elif isinstance(w, gtk.RadioButton):
-            if w.get_active():
-                key, val = key.rsplit('_', 1)
-                self.gc.set_string(self.gconf_path(key), val)
+            if not w.get_active():
+                return
+            key, val = key.rsplit('_', 1)
+            value = (self.gc.set_string, val)
         elif isinstance(w, gtk.CheckButton):
-            self.gc.set_bool(self.gconf_path(key), int(w.get_active()))
+            value = (self.gc.set_bool, bool(w.get_active()))
         elif isinstance(w, gtk.ColorButton):
-            self.gc.set_string(self.gconf_path(key),
-                               '%s%s' % (w.get_color().to_string(), hex(w.get_alpha())[2:]))
+            value = (self.gc.set_string, '%s%s' % (w.get_color().to_string(), hex(w.get_alpha())[2:]))
+        else:
+            return
+        self.desktop_control.conf.set(key, value[1])
+        self.pending[key] = value
+        if self.write_source:
+            gobject.source_remove(self.write_source)
+        self.write_source = gobject.timeout_add(WRITE_DELAY, self.write_pending)
+
+    def write_pending(self):
+        if self.write_source:
+            gobject.source_remove(self.write_source)
+            self.write_source = None
+        for key, (set_value, value) in self.pending.items():
+            set_value(self.gconf_path(key), value)
+        self.pending.clear()
+        return False
 
     def set_callbacks(self, w):
         for name in widget_names:
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the Rhythmbox Desktop Art plug-in
+#
+# Copyright © 2008 Mathias Nedrebø < mathias at nedrebo dot org >
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+#
+# Caches for finding cover images on disk. Nothing in here depends on
+# Rhythmbox or gtk.
+#
+
+import mimetypes
+import os
+import sqlite3
+import stat
+import threading
+import time
+
+from os import path, listdir
+from urllib import url2pathname
+from LRUCache import LRUCache
+
+IMAGE_NAMES = ['cover', 'album', 'albumart', '.folder', 'folder']
+COVER_CACHE_DIRS = ['~/.gnome2/rhythmbox/covers', '~/.cache/rhythmbox/covers/']
+COVER_TYPES = ['jpg', 'png', 'jpeg', 'gif', 'svg']
+COVER_DB = "~/.gnome2/rhythmbox/desktop-art/covers.db"
+
+class DirectoryIndex():
+    # Cover image candidates of music directories, keyed by path and
+    # checked against the directory mtime, so a directory is only listed
+    # again after something in it changed
+    def __init__(self, image_names, max_dirs):
+        self.image_names = image_names
+        self.dirs = LRUCache(max_dirs)
+
+    def find_cover(self, cover_dir):
+        try:
+            st = stat_dir(cover_dir)
+        except OSError:
+            st = None
+        if not st:
+            return None
+        mtime = st.st_mtime
+        entry = self.dirs.get(cover_dir, valid=lambda e: e[0] == mtime)
+        if entry is None:
+            entry = (mtime, self.scan(cover_dir))
+            self.dirs.put(cover_dir, entry)
+        return entry[1] and entry[1][0] or None
+
+    def scan(self, cover_dir):
+        candidates = []
+        for f in listdir(cover_dir):
+            file_name = path.join(cover_dir, f)
+            mt = mimetypes.guess_type(file_name)[0]
+            if mt and mt.startswith('image/'):
+                if path.splitext(f)[0].lower() in self.image_names:
+                    candidates.append(file_name)
+        return candidates
+
+    def get_stats(self):
+        return self.dirs.get_stats()
+
+class MissingCovers():
+    # Albums known to have no cover, per album key and track directory.
+    # An entry holds until its ttl in seconds runs out or the directory
+    # mtime changes, and can be dropped early by forget.
+    def __init__(self, ttl, max_items):
+        self.ttl = ttl
+        self.entries = LRUCache(max_items)
+
+    def add(self, album, cover_dir):
+        try:
+            st = stat_dir(cover_dir)
+        except OSError:
+            st = None
+        self.entries.put((album, cover_dir), (time.time() + self.ttl, st and st.st_mtime))
+
+    def contains(self, album, cover_dir):
+        if self.ttl <= 0:
+            return False
+        try:
+            st = stat_dir(cover_dir)
+        except OSError:
+            st = None
+        mtime = st and st.st_mtime
+        now = time.time()
+        return self.entries.get((album, cover_dir), valid=lambda e: e[0] > now and e[1] == mtime) is not None
+
+    def forget(self, album, cover_dir):
+        self.entries.discard((album, cover_dir))
+
+    def get_stats(self):
+        return self.entries.get_stats()
+
+def track_dir(uri):
+    return path.dirname(url2pathname(uri).replace('file://', ''))
+
+def stat_dir(dir_name):
+    # os.stat result of a directory, None if it isn't one
+    st = os.stat(dir_name)
+    if stat.S_ISDIR(st.st_mode):
+        return st
+    return None
+
+def normalize_key(artist, album):
+    # Album key tolerant of case and whitespace differences, as UTF-8 for
+    # both str, as from rhythmdb, and unicode, as from ElementTree
+    key = u'%s - %s' % (to_unicode(artist), to_unicode(album))
+    return u' '.join(key.split()).lower().encode('utf-8')
+
+def to_unicode(s):
+    if isinstance(s, unicode):
+        return s
+    return str(s).decode('utf-8', 'replace')
+
+class CoverCacheIndex():
+    # Covers in the Rhythmbox covers cache directories, named
+    # "artist - album.ext", keyed by normalized artist and album. A
+    # directory is only listed again when its mtime changed, and then
+    # only new file names are parsed.
+    def __init__(self, cache_dirs, file_types):
+        self.cache_dirs = [path.expanduser(d) for d in cache_dirs]
+        self.file_types = file_types
+        self.dirs = {}
+        self.lock = threading.Lock()
+
+    def find_cover(self, artist, album):
+        key = normalize_key(artist, album)
+        for cache_dir in self.cache_dirs:
+            covers = self.get_covers(cache_dir)
+            if key in covers:
+                return covers[key]
+        return None
+
+    def get_covers(self, cache_dir):
+        try:
+            st = stat_dir(cache_dir)
+        except OSError:
+            st = None
+        if not st:
+            return {}
+        with self.lock:
+            entry = self.dirs.get(cache_dir)
+            if entry is None or entry[0] != st.st_mtime:
+                entry = self.scan(cache_dir, st.st_mtime, entry and entry[1] or {})
+                self.dirs[cache_dir] = entry
+            return entry[2]
+
+    def scan(self, cache_dir, mtime, old_files):
+        files = {}
+        for f in listdir(cache_dir):
+            if f in old_files:
+                files[f] = old_files[f]
+            else:
+                stem, ext = path.splitext(f)
+                ext = ext[1:].lower()
+                if ext in self.file_types:
+                    files[f] = (normalize_key(*(stem.split(' - ', 1) + [''])[:2]), self.file_types.index(ext))
+        covers = {}
+        ranks = {}
+        for f, (key, rank) in files.items():
+            if key not in covers or rank < ranks[key]:
+                covers[key] = path.join(cache_dir, f)
+                ranks[key] = rank
+        return (mtime, files, covers)
+
+class CoverDatabase():
+    # Resolved covers kept across restarts in sqlite, mapping an album key
+    # and track directory to the cover path and the mtimes of the cover and
+    # the directory. Entries are checked lazily with two stats when used, so
+    # an image added to the directory is found, and writes are batched.
+    def __init__(self, file_name, batch_size=20, max_delay=30):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.last_flush = time.time()
+        try:
+            if not path.isdir(path.dirname(file_name)):
+                os.makedirs(path.dirname(file_name))
+            self.conn = sqlite3.connect(file_name, check_same_thread=False)
+            # Databases without the directory mtime are dropped, the covers
+            # are found again
+            columns = [row[1] for row in self.conn.execute('PRAGMA table_info(covers)')]
+            if columns and 'dir_mtime' not in columns:
+                self.conn.execute('DROP TABLE covers')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS covers '
+                              '(album TEXT, directory TEXT, cover TEXT, mtime REAL, dir_mtime REAL, '
+                              'PRIMARY KEY (album, directory))')
+            self.conn.commit()
+        except (OSError, sqlite3.Error), e:
+            print 'Cover database disabled: %s' % e
+            self.conn = None
+
+    def lookup(self, album, directory):
+        with self.lock:
+            key = (album, directory)
+            if key in self.pending:
+                row = self.pending[key]
+            else:
+                row = self.execute('SELECT cover, mtime, dir_mtime FROM covers WHERE album = ? AND directory = ?', key)
+                row = row and row.fetchone()
+        if not row:
+            return None
+        cover, mtime, dir_mtime = row
+        try:
+            valid = os.stat(cover).st_mtime == mtime and os.stat(directory).st_mtime == dir_mtime
+        except OSError:
+            valid = False
+        if not valid:
+            self.forget(album, directory)
+            return None
+        return cover
+
+    def store(self, album, directory, cover):
+        try:
+            mtime = os.stat(cover).st_mtime
+            dir_mtime = os.stat(directory).st_mtime
+        except OSError:
+            return
+        self.set_pending(album, directory, (cover, mtime, dir_mtime))
+
+    def forget(self, album, directory):
+        self.set_pending(album, directory, None)
+
+    def set_pending(self, album, directory, row):
+        with self.lock:
+            self.pending[(album, directory)] = row
+            if len(self.pending) >= self.batch_size or time.time() - self.last_flush >= self.max_delay:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        self.last_flush = time.time()
+        if not self.pending:
+            return
+        self.execute_many('INSERT OR REPLACE INTO covers VALUES (?, ?, ?, ?, ?)',
+                          [k + v for k, v in self.pending.items() if v])
+        self.execute_many('DELETE FROM covers WHERE album = ? AND directory = ?',
+                          [k for k, v in self.pending.items() if not v])
+        if self.conn:
+            self.conn.commit()
+        self.pending.clear()
+
+    def execute(self, sql, args):
+        if self.conn:
+            try:
+                return self.conn.execute(sql, args)
+            except sqlite3.Error, e:
+                print 'Cover database error: %s' % e
+        return None
+
+    def execute_many(self, sql, rows):
+        if self.conn and rows:
+            try:
+                self.conn.executemany(sql, rows)
+            except sqlite3.Error, e:
+                print 'Cover database error: %s' % e
+
+    def close(self):
+        self.flush()
+        if self.conn:
+            self.conn.close()
+            self.conn = None
@@ -25,69 +25,197 @@
 #
 #
 
+from __future__ import division
+
 import rhythmdb
 import DesktopControl
-import mimetypes
 import rb, gtk, gobject
+import hashlib
+import os
+import tempfile
 
-from os import path, listdir
-from urllib import url2pathname
+from os import path
+from CoverIndex import DirectoryIndex, CoverCacheIndex, CoverDatabase, MissingCovers, normalize_key, track_dir
+from CoverIndex import IMAGE_NAMES, COVER_CACHE_DIRS, COVER_TYPES, COVER_DB
+from WorkerPool import WorkerPool, PRIORITY_LOW
 
-IMAGE_NAMES = ['cover', 'album', 'albumart', '.folder', 'folder']
-STORAGE_LOC = "~/.gnome2/rhythmbox/covers/"
+STORAGE_LOC = "~/.gnome2/rhythmbox/covers/desktop-art/"
+STORAGE_QUALITY = "100"
 RETRIES = 5
+DIR_INDEX_SIZE = 1024
+MISSING_SIZE = 1024
+WORKERS = 2
 
 class CoverManager():
-    def __init__(self, db):
+    def __init__(self, db, config, decode_image=None, prefetch_image=None):
         self.db = db
+        self.decode_image = decode_image
+        self.prefetch_image = prefetch_image
+        self.dir_index = DirectoryIndex(IMAGE_NAMES, DIR_INDEX_SIZE)
+        self.cache_index = CoverCacheIndex(COVER_CACHE_DIRS, COVER_TYPES)
+        self.cover_db = CoverDatabase(path.expanduser(COVER_DB))
+        self.pool = WorkerPool(WORKERS)
+
+        self.gconf_keys = ['prefetch_count', 'prefetch_kb', 'store_downscale', 'missing_cover_ttl']
+        self.conf = config
+        self.conf.subscribe(['missing_cover_ttl'], self.conf_changed)
+        self.missing = MissingCovers(self.conf['missing_cover_ttl'], MISSING_SIZE)
+        # The cover can't be shown larger than the screen
+        self.store_max_size = min(gtk.gdk.screen_width(), gtk.gdk.screen_height())
+
+    def conf_changed(self, keys):
+        self.missing.ttl = self.conf['missing_cover_ttl']
+
+    def close(self):
+        self.conf.unsubscribe(self.conf_changed)
+        self.pool.stop()
+        self.cover_db.close()
+
+    def request_cover_and_song_info(self, db_entry, still_current, callback, *args):
+        # Disk access, storing and image decoding run on the worker pool.
+        # callback(cover, song_info, image, *args) is called on the main
+        # loop, image being the cover decoded by decode_image, or None.
+        # Once still_current() returns False the request is dropped.
+        song_info = self.get_song_info(db_entry)
+        if not db_entry:
+            callback(None, song_info, None, *args)
+            return
+        self.pool.submit(self.find_and_decode, (db_entry.get_playback_uri(), song_info),
+                         self.local_cover_found, (db_entry, song_info, still_current, callback, args))
+
+    def local_cover_found(self, result, db_entry, song_info, still_current, callback, args):
+        if not still_current():
+            return
+        cover_file, image = result or (None, None)
+        if cover_file:
+            callback(cover_file, song_info, image, *args)
+            return
+        # Extra metadata has to be requested from the main loop
+        cover_art = self.db.entry_request_extra_metadata(db_entry, "rb:coverArt")
+        if cover_art==None:
+            callback(DesktopControl.UNKNOWN_COVER, song_info, None, *args)
+            return
+        self.pool.submit(self.store_and_decode, (cover_art, song_info, db_entry.get_playback_uri()),
+                         self.cover_art_stored, (song_info, callback, args))
+
+    def cover_art_stored(self, result, song_info, callback, args):
+        cover_file, image = result or (DesktopControl.UNKNOWN_COVER, None)
+        callback(cover_file, song_info, image, *args)
+
+    def find_local_cover(self, uri, song_info):
+        # Cover found before, possibly in an earlier session
+        cover_dir = track_dir(uri)
+        album = normalize_key(song_info['artist'], song_info['album'])
+        cover_file = self.cover_db.lookup(album, cover_dir)
+        if cover_file or self.missing.contains(album, cover_dir):
+            return cover_file
 
-    def get_cover_and_song_info(self, db_entry):
-        return (self.get_cover(db_entry), self.get_song_info(db_entry))
+        # Find cover in music dir, or else saved by artdisplay plugin
+        cover_file = self.dir_index.find_cover(cover_dir) or \
+                     self.cache_index.find_cover(song_info['artist'], song_info['album'])
+        if cover_file:
+            self.cover_db.store(album, cover_dir, cover_file)
+        else:
+            self.missing.add(album, cover_dir)
+        return cover_file
 
-    def get_cover(self, db_entry=None):
-        # Find cover in music dir
+    def cover_changed(self, db_entry):
+        # New coverArt metadata, an album known to be missing its cover
+        # might have one now
         if db_entry:
-            cover_dir = path.dirname(url2pathname(db_entry.get_playback_uri()).replace('file://', ''))
-            if path.isdir(cover_dir):
-                for f in listdir(cover_dir):
-                    file_name = path.join(cover_dir, f)
-                    mt = mimetypes.guess_type(file_name)[0]
-                    if mt and mt.startswith('image/'):
-                        if path.splitext(f)[0].lower() in IMAGE_NAMES:
-                            return file_name
-
-            # Find cover saved by artdisplay plugin
             song_info = self.get_song_info(db_entry)
-            for rb_cover_path in ('~/.gnome2/rhythmbox/covers', '~/.cache/rhythmbox/covers/'):
-                for file_type in ('jpg', 'png', 'jpeg', 'gif', 'svg'):
-                    cover_file = path.join(path.expanduser(rb_cover_path),
-                                           '%s - %s.%s' %
-                                           (song_info['artist'],
-                                            song_info['album'],
-                                            file_type))
-                    if path.isfile(cover_file):
-                        print "Found image in cache folder"
-                        return cover_file
-
-            # Find the image from AlbumArt plugin
-            cover_art = self.db.entry_request_extra_metadata(db_entry, "rb:coverArt")
-
-            # If image not found return
-            if cover_art==None:
-                print "Image not found, bloody timeouts"
-                return DesktopControl.UNKNOWN_COVER
-    
-            # Do the dirty work here
-            cover_file = path.expanduser(STORAGE_LOC) + song_info['title'] + "-" + song_info['artist'] + ".jpg"
-            cover_art.save(cover_file, "jpeg", {"quality":"100"})
-            print "Returning cover file"
+            cover_dir = track_dir(db_entry.get_playback_uri())
+            self.missing.forget(normalize_key(song_info['artist'], song_info['album']), cover_dir)
+
+    def store_cover_art(self, cover_art, song_info):
+        # Store cover art fetched by Rhythmbox under the digest of its
+        # pixels, so an image already stored is never written again. The
+        # file is written to a temporary name and renamed into place.
+        digest = hashlib.sha1('%d %d %d %d ' % (cover_art.get_width(), cover_art.get_height(),
+                                                cover_art.get_rowstride(), cover_art.get_has_alpha()))
+        digest.update(cover_art.get_pixels())
+        storage_dir = path.expanduser(STORAGE_LOC)
+        cover_file = path.join(storage_dir, '%s.jpg' % digest.hexdigest())
+        if path.isfile(cover_file):
             return cover_file
-            
 
-            # No cover found
-            return DesktopControl.UNKNOWN_COVER
-        # Not playing
-        return None
+        w, h = cover_art.get_width(), cover_art.get_height()
+        if self.conf['store_downscale'] and max(w, h) > self.store_max_size:
+            scale = self.store_max_size / max(w, h)
+            cover_art = cover_art.scale_simple(max(1, int(w * scale + 0.5)), max(1, int(h * scale + 0.5)), gtk.gdk.INTERP_BILINEAR)
+
+        if not path.isdir(storage_dir):
+            os.makedirs(storage_dir)
+        fd, tmp_file = tempfile.mkstemp(suffix='.tmp', dir=storage_dir)
+        os.close(fd)
+        try:
+            cover_art.save(tmp_file, "jpeg", {"quality":STORAGE_QUALITY})
+            os.rename(tmp_file, cover_file)
+        except:
+            os.remove(tmp_file)
+            raise
+        return cover_file
+
+    def find_and_decode(self, uri, song_info):
+        return self.decode(self.find_local_cover(uri, song_info))
+
+    def store_and_decode(self, cover_art, song_info, uri):
+        cover_file = self.store_cover_art(cover_art, song_info)
+        cover_dir = track_dir(uri)
+        self.cover_db.store(normalize_key(song_info['artist'], song_info['album']), cover_dir, cover_file)
+        return self.decode(cover_file)
+
+    def decode(self, cover_file):
+        if cover_file and self.decode_image:
+            return (cover_file, self.decode_image(cover_file))
+        return (cover_file, None)
+
+    def prefetch(self, shell, player, db_entry):
+        # Resolve, decode and scale the covers of the next entries at low
+        # priority, so they are ready when the track changes
+        if not (db_entry and self.prefetch_image and self.conf['prefetch_count'] > 0):
+            return
+        entries = self.get_upcoming_entries(shell, player, db_entry, self.conf['prefetch_count'])
+        items = [(e.get_playback_uri(), self.get_song_info(e)) for e in entries]
+        if items:
+            self.pool.submit(self.prefetch_covers, (items, self.conf['prefetch_kb'] * 1024), priority=PRIORITY_LOW)
+
+    def prefetch_covers(self, items, max_bytes):
+        # Covers only known through extra metadata need the main loop, so
+        # only covers on disk are prefetched
+        used = 0
+        for uri, song_info in items:
+            cover_file = self.find_local_cover(uri, song_info)
+            if cover_file:
+                used += self.prefetch_image(cover_file)
+                if used >= max_bytes:
+                    break
+
+    def get_upcoming_entries(self, shell, player, db_entry, count):
+        # Entries in the play queue, followed by the ones after db_entry in
+        # the playing source
+        entries = []
+        try:
+            queue = shell.props.queue_source
+            for row in queue.props.query_model:
+                if row[0] != db_entry:
+                    entries.append(row[0])
+            source = player.get_playing_source()
+            if source and source != queue:
+                model = source.props.query_model
+                entry = db_entry
+                while len(entries) < count:
+                    entry = model.get_next_from_entry(entry)
+                    if not entry:
+                        break
+                    entries.append(entry)
+        except (AttributeError, TypeError):
+            pass
+        return entries[:count]
+
+    def get_stats(self):
+        return {'directories': self.dir_index.get_stats(),
+                'missing': self.missing.get_stats()}
 
     def get_song_info(self, db_entry=None):
         song_info = {}
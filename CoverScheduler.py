@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the Rhythmbox Desktop Art plug-in
+#
+# Copyright © 2008 Mathias Nedrebø < mathias at nedrebo dot org >
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import gobject
+import DesktopControl
+
+class CoverScheduler():
+    # Resolves the cover of the playing entry, with exactly one pending job.
+    # Covers not found yet are retried with exponential backoff, up to
+    # max_tries times, and at once when coverArt metadata for the entry
+    # arrives. Lookups run on the cover manager's worker pool, results of
+    # stale lookups are dropped and the rest are passed to
+    # deliver(cover, song_info, image).
+    def __init__(self, cover_manager, deliver, first_delay, max_delay, max_tries):
+        self.cover_manager = cover_manager
+        self.deliver = deliver
+        self.first_delay = first_delay
+        self.max_delay = max_delay
+        self.max_tries = max_tries
+        self.entry = None
+        self.result = None
+        self.source = None
+        self.job = 0
+        self.suspended = False
+
+    def set_entry(self, entry):
+        if entry is not None and entry == self.entry and self.found():
+            # Same track, e.g. paused, nothing to look up
+            self.deliver(*self.result)
+            return
+        self.cancel()
+        self.entry = entry
+        self.result = None
+        if not self.suspended:
+            self.resolve(True)
+
+    def notify(self, entry):
+        # New coverArt metadata, look again without waiting for the backoff
+        self.cover_manager.cover_changed(entry)
+        if entry is not None and entry == self.entry and not self.found() and not self.suspended:
+            self.cancel()
+            self.resolve(False)
+
+    def cancel(self):
+        self.job += 1
+        if self.source:
+            gobject.source_remove(self.source)
+            self.source = None
+        self.tries = 0
+        self.delay = self.first_delay
+
+    def suspend(self):
+        # Nothing is looked up until resume, not even for a new entry
+        self.suspended = True
+        self.cancel()
+
+    def resume(self):
+        self.suspended = False
+        # Deliver what changed while suspended, including playback stopping
+        if self.result is None or (self.entry is not None and not self.found()):
+            self.cancel()
+            self.resolve(self.result is None)
+
+    def found(self):
+        return self.result is not None and self.result[0] not in (None, DesktopControl.UNKNOWN_COVER)
+
+    def resolve(self, always_deliver):
+        self.source = None
+        self.cover_manager.request_cover_and_song_info(self.entry, self.is_current(self.job), self.resolved, self.job, always_deliver)
+        return False
+
+    def is_current(self, job):
+        return lambda: job == self.job
+
+    def resolved(self, cover, song_info, image, job, always_deliver):
+        if job != self.job:
+            # The track changed while looking
+            return
+        self.result = (cover, song_info, image)
+        if always_deliver or self.found():
+            self.deliver(*self.result)
+        if self.entry is not None and not self.found():
+            self.schedule()
+
+    def schedule(self):
+        if self.tries >= self.max_tries:
+            return
+        self.tries += 1
+        self.source = gobject.timeout_add(self.delay, self.resolve, False)
+        self.delay = min(2 * self.delay, self.max_delay)
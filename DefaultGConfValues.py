@@ -19,6 +19,9 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import gtk, gconf
+import time
+
+start = time.time()
 
 gconf_plugin_path = '/apps/rhythmbox/plugins/desktop-art/'
 
@@ -36,16 +39,35 @@ defaults = {'roundness'            : 0.3,
             'reflection_height'    : 0.4,
             'reflection_intensity' : 0.4,
             'hover_size'           : 0.7,
-            'border'               : 0.06}
+            'border'               : 0.06,
+            'scale_cache_kb'       : 16384,
+            'image_cache_kb'       : 32768,
+            'prefetch_count'       : 3,
+            'prefetch_kb'          : 16384,
+            'store_downscale'      : False,
+            'missing_cover_ttl'    : 600,
+            'idle_timeout'         : 300,
+            'idle_poll'            : 2,
+            'animation_fps'        : 30,
+            'hover_duration'       : 200,
+            'crossfade_duration'   : 400,
+            'frame_timing'         : False,
+            'frame_budget'         : 16.7,
+            'frame_timing_log'     : 0}
 
 def gconf_path(key):
     return '%s%s' % (gconf_plugin_path, key)
 
 gc = gconf.client_get_default()
 
+# One directory fetch tells which keys are set, instead of a round trip
+# per key
+existing = set(entry.get_key().split('/')[-1] for entry in gc.all_entries(gconf_plugin_path[:-1])
+               if entry.get_value() and not entry.get_is_default())
+
 for key, val in defaults.items():
     path = gconf_path(key)
-    if gc.get_without_default(path) == None:
+    if key not in existing:
         if isinstance(val, bool):
             gc.set_bool(path, val)
         elif isinstance(val, int):
@@ -56,3 +78,6 @@ for key, val in defaults.items():
             gc.set_string(path, val)
         else:
             print 'Datatype %s is not supported' % type(val)
+
+# Seconds spent setting up defaults, part of the startup timing report
+init_time = time.time() - start
@@ -21,12 +21,18 @@
 from __future__ import division
 
 import sys
+import math
+import time
 import gobject
 import gtk, cairo, pango
 import gconf
 import rsvg
-from roundedrec import roundedrec
-from ConfigDialog import ConfigDialog
+from roundedrec import roundedrec, in_roundedrec
+from boxblur import box_blur
+from os import stat
+from LRUCache import LRUCache, pixbuf_size
+from FrameTimer import FrameTimer
+from FrameClock import FrameClock, Transition
 
 # CONSTANTS
 
@@ -35,6 +41,11 @@ POSITION_NW = 'nw'
 POSITION_NE = 'ne'
 POSITION_SW = 'sw'
 POSITION_SE = 'se'
+FRAME_STAGES = ['expose', 'clear', 'layout', 'song_text', 'buttons', 'cover', 'compose',
+                'reflection_blur', 'reflection_mask', 'input_mask', 'border']
+# Keys that don't change the picture, applied without drawing it again
+RUNTIME_KEYS = ['frame_timing', 'frame_budget', 'frame_timing_log', 'animation_fps',
+                'hover_duration', 'crossfade_duration', 'scale_cache_kb', 'image_cache_kb']
 
 gconf_plugin_path = '/apps/rhythmbox/plugins/desktop-art'
 
@@ -45,28 +56,27 @@ def get_icon_path(theme, name, size):
 def gconf_path(key):
     return '%s/%s' % (gconf_plugin_path, key)
 
-def read_gconf_values(values, keys):
-    gc = gconf.client_get_default()
-    for key in keys:
-        val = gc.get_without_default(gconf_path(key))
-        if val.type == gconf.VALUE_FLOAT:
-            values[key] = val.get_float()
-        elif val.type == gconf.VALUE_INT:
-            values[key] = val.get_int()
-        elif val.type == gconf.VALUE_STRING:
-            values[key] = val.get_string()
-        elif val.type == gconf.VALUE_BOOL:
-            values[key] = val.get_bool()
-        # Parse color strings
-        if 'color' in key:
-            values['%s_r' % key] = int(values[key][ 1: 5], 16) / int('ffff', 16)
-            values['%s_g' % key] = int(values[key][ 5: 9], 16) / int('ffff', 16)
-            values['%s_b' % key] = int(values[key][ 9:13], 16) / int('ffff', 16)
-            values['%s_a' % key] = int(values[key][13:17], 16) / int('ffff', 16)
-
-def reread_gconf_value(conf, keys, key):
-    if key in keys:
-        read_gconf_values(conf, [key])
+def image_key(file_name):
+    # (path, mtime, size) identifying the contents of an image file
+    try:
+        st = stat(file_name)
+    except (OSError, TypeError):
+        return None
+    return (file_name, st.st_mtime, st.st_size)
+
+def load_image(file_name):
+    # Decode an image as an rsvg handle, or else as a pixbuf. Returns
+    # (image, width, height, is_svg), or None if it can't be decoded.
+    # Safe to call from worker threads.
+    try:
+        image = rsvg.Handle(file=file_name)
+        return (image, image.props.width, image.props.height, True)
+    except:
+        try:
+            image = gtk.gdk.pixbuf_new_from_file(file_name)
+            return (image, image.get_width(), image.get_height(), False)
+        except:
+            return None
 
 class _ContextMenu(gtk.Menu):
     def __init__(self, desktop_control, configure_glade_file, shell):
@@ -80,7 +90,7 @@ class _ContextMenu(gtk.Menu):
         self.add(gtk.SeparatorMenuItem())
 
         preferences = gtk.ImageMenuItem(gtk.STOCK_PREFERENCES)
-        conf_dialog = ConfigDialog(configure_glade_file, gconf_plugin_path, self)
+        self.conf_dialog = None
         preferences.connect('activate', self.show_preferences_dialog, desktop_control, configure_glade_file)
         self.add(preferences)
 
@@ -94,21 +104,36 @@ class _ContextMenu(gtk.Menu):
         self.shell.props.visibility = menu_item.get_active()
 
     def show_preferences_dialog(self, menu_item, desktop_control, configure_glade_file):
-        conf_dialog = ConfigDialog(configure_glade_file, gconf_plugin_path, desktop_control)
-        conf_dialog.run()
+        # Built on first use, parsing its glade file is slow
+        if not self.conf_dialog:
+            from ConfigDialog import ConfigDialog
+            self.conf_dialog = ConfigDialog(configure_glade_file, gconf_plugin_path, desktop_control)
+        self.conf_dialog.run()
 
 class DesktopControl(gtk.DrawingArea):
-    def __init__(self, icons, shell, player, conf_glade):
+    def __init__(self, icons, shell, player, conf_glade, config):
         gtk.DrawingArea.__init__(self)
         self.connect("expose_event", self.expose)
 
         self.shell = shell
-        self.cover_image = CoverImage(icons)
-        self.song_info = SongInfo()
-        self.desktop_buttons = DesktopButtons(icons, player)
-        self.context_menu = _ContextMenu(self, conf_glade, shell)
+        self.cover_image = CoverImage(icons, config)
+        self.song_info = SongInfo(config)
+        self.desktop_buttons = DesktopButtons(icons, player, config)
+        self.conf_glade = conf_glade
+        self.context_menu = None
 
         self.draw_border = False
+        self.graphics = None
+        self.graphics_key = None
+        self.reflection = None
+        self.reflection_key = None
+        self.hover_layers = {}
+        self.regions = {}
+        self.region_matrix = None
+        self.damage = set()
+        self.input_mask_geometry = None
+        self.input_mask_parent = None
+        self.suspended = False
 
         # Find and set up icon and font
         icon_theme = gtk.icon_theme_get_default()
@@ -117,51 +142,87 @@ class DesktopControl(gtk.DrawingArea):
         gc.add_dir('/apps/nautilus/preferences', gconf.CLIENT_PRELOAD_NONE)
         gc.notify_add('/apps/nautilus/preferences/desktop_font', self.font_changed, [self.song_info])
 
-        self.add_events(gtk.gdk.ENTER_NOTIFY_MASK | gtk.gdk.LEAVE_NOTIFY_MASK | gtk.gdk.POINTER_MOTION_MASK | gtk.gdk.BUTTON_PRESS_MASK)
+        self.add_events(gtk.gdk.ENTER_NOTIFY_MASK | gtk.gdk.LEAVE_NOTIFY_MASK | gtk.gdk.POINTER_MOTION_MASK | gtk.gdk.POINTER_MOTION_HINT_MASK | gtk.gdk.BUTTON_PRESS_MASK)
         self.mouse_over = False
         self.hover_time_out = None
+        self.pointer = None
+        self.motion_source = None
         self.connect('enter-notify-event', self.enter_leave)
         self.connect('leave-notify-event', self.enter_leave)
         self.connect('motion-notify-event', self.mouse_motion, self.desktop_buttons)
         self.connect('button-press-event', self.button_press, self.desktop_buttons)
 
-        self.gconf_keys = ['background_color', 'roundness', 'hover_size', 'border', 'draw_reflection', 'reflection_height', 'reflection_intensity', 'blur', 'text_position']
-        self.conf = {}
-        read_gconf_values(self.conf, self.gconf_keys)
-
-        self.set_gconf_callbacks([self, self.cover_image, self.song_info, self.desktop_buttons])
-
-    def set_gconf_callbacks(self, affected):
-        gc = gconf.client_get_default()
-        for entry in gc.all_entries(gconf_plugin_path):
-            path = entry.get_key()
-            key = path.split('/')[-1]
-            gc.notify_add(path, self.gconf_cb, {'key': key, 'affected': affected})
-
-    def gconf_cb(self, client, cnxn_id, entry, ud):
-        for af in ud['affected']:
-            reread_gconf_value(af.conf, af.gconf_keys, ud['key'])
-        self.queue_draw()
+        self.gconf_keys = ['background_color', 'roundness', 'hover_size', 'border', 'draw_reflection', 'reflection_height', 'reflection_intensity', 'blur', 'text_position',
+                           'frame_timing', 'frame_budget', 'frame_timing_log', 'animation_fps', 'hover_duration', 'crossfade_duration']
+        self.conf = config
+        self.frame_timer = None
+        self.set_frame_timing()
+
+        # Hover and song change transitions
+        self.clock = FrameClock(self.conf['animation_fps'], self.animate)
+        self.hover_transition = None
+        self.fade = None
+
+        keys = set(self.gconf_keys)
+        for part in [self.cover_image, self.song_info, self.desktop_buttons]:
+            keys.update(part.gconf_keys)
+        config.subscribe(keys, self.conf_changed)
+
+    def conf_changed(self, keys):
+        if [k for k in keys if k.startswith('frame_')]:
+            self.set_frame_timing()
+        if 'scale_cache_kb' in keys or 'image_cache_kb' in keys:
+            self.cover_image.set_cache_sizes()
+        if 'animation_fps' in keys:
+            self.clock.set_fps(self.conf['animation_fps'])
+        if not self.animated(self.conf['hover_duration']):
+            self.hover_transition = None
+        if not self.animated(self.conf['crossfade_duration']):
+            self.fade = None
+        if not (self.hover_transition or self.fade):
+            self.clock.stop()
+        if [k for k in keys if k not in RUNTIME_KEYS]:
+            self.invalidate()
+
+    def close(self):
+        self.conf.unsubscribe(self.conf_changed)
+        self.clock.stop()
 
     def button_press(self, w, e, affected):
         if e.button == 1:
             if not affected.button_press():
                 self.shell.props.visibility = not self.shell.props.visibility
         elif e.button == 3:
+            if not self.context_menu:
+                self.context_menu = _ContextMenu(self, self.conf_glade, self.shell)
             self.context_menu.show(e)
 
     def mouse_motion(self, w, e, affected):
-        if affected.set_mouse_position(self, e.x, e.y):
-            self.queue_draw()
+        # Motion hints and an idle callback running before the redraw keep
+        # it to one hover evaluation per frame
+        if e.is_hint:
+            x, y, state = e.window.get_pointer()
+        else:
+            x, y = e.x, e.y
+        self.pointer = (x, y)
+        if not self.motion_source:
+            self.motion_source = gobject.idle_add(self.update_mouse_position, affected, priority=gobject.PRIORITY_HIGH_IDLE)
+
+    def update_mouse_position(self, affected):
+        self.motion_source = None
+        if affected.set_mouse_position(*self.pointer):
+            self.invalidate(['buttons'])
+        return False
 
     def font_changed(self, client, cnxn_id, entry, affected):
         for a in affected:
             a.font_changed(entry.get_value().get_string())
-        self.queue_draw()
+        self.invalidate(['text'])
 
     def icon_theme_changed(self, icon_theme, affected):
         for a in affected:
             a.icon_theme_changed(icon_theme)
+        self.invalidate()
 
     def enter_leave(self, w, e):
         if self.hover_time_out:
@@ -171,22 +232,160 @@ class DesktopControl(gtk.DrawingArea):
         self.hover_time_out = gobject.timeout_add(350, self.set_hover, hover)
 
     def set_hover(self, hover):
+        if self.suspended:
+            hover = False
         tmp = self.mouse_over
-        self.mouse_over = hover
         if tmp != hover:
-            self.queue_draw()
+            # The current layers are one end of the transition, a hover
+            # change does not make the layers of either end stale
+            hover_layers = self.hover_layers
+            if self.graphics is not None and self.reflection is not None and not self.damage:
+                hover_layers[tmp] = (self.graphics_key + self.reflection_key, self.graphics, self.reflection)
+            if self.animated(self.conf['hover_duration']):
+                self.hover_transition = (self.get_hover_value(), hover and 1 or 0, Transition(self.conf['hover_duration']))
+                self.clock.start()
+            else:
+                self.hover_transition = None
+            self.mouse_over = hover
+            self.invalidate()
+            if self.hover_transition:
+                self.hover_layers = hover_layers
+
+    def get_hover_value(self):
+        # 0 not hovering, 1 hovering, in between while growing or shrinking
+        if self.hover_transition:
+            start, end, transition = self.hover_transition
+            return start + (end - start) * transition.progress()
+        return self.mouse_over and 1 or 0
+
+    def animated(self, duration):
+        return duration > 0 and self.conf['animation_fps'] > 0 and not self.suspended
+
+    def animate(self):
+        # Frame clock tick, returns whether transitions are still running
+        if self.hover_transition and self.hover_transition[2].done():
+            self.hover_transition = None
+        if self.fade and self.fade[3].done():
+            self.fade = None
+        self.queue_draw()
+        return bool(self.hover_transition or self.fade)
+
+    def set_suspended(self, suspended):
+        # Idle session, nobody is looking
+        self.suspended = suspended
+        if suspended:
+            self.clock.stop()
+            self.hover_transition = None
+            self.fade = None
+            if self.hover_time_out:
+                gobject.source_remove(self.hover_time_out)
+                self.hover_time_out = None
+            # The cached layers may show the buttons
+            self.mouse_over = False
+            self.graphics = None
+            self.reflection = None
+        else:
+            self.invalidate()
+
+    def set_frame_timing(self):
+        if not self.conf['frame_timing']:
+            self.frame_timer = None
+        elif self.frame_timer:
+            self.frame_timer.budget = self.conf['frame_budget']
+            self.frame_timer.log_interval = self.conf['frame_timing_log']
+        else:
+            self.frame_timer = FrameTimer(FRAME_STAGES, self.conf['frame_budget'], self.conf['frame_timing_log'])
+
+    def get_frame_stats(self):
+        # Per stage p50/p95/p99 in ms, or None when frame timing is off
+        return self.frame_timer and self.frame_timer.get_stats()
+
+    def start_frame(self):
+        if self.frame_timer:
+            self.frame_timer.start_frame()
+
+    def mark(self, stage):
+        if self.frame_timer:
+            self.frame_timer.mark(stage)
+
+    def end_frame(self):
+        if self.frame_timer:
+            self.frame_timer.end_frame()
 
     def expose(self, widget, event):
+        self.start_frame()
         cc = self.window.cairo_create()
-        cc.rectangle(event.area.x, event.area.y, event.area.width, event.area.height)
+        cc.region(event.region)
         cc.clip()
+        self.mark('expose')
         self.draw(cc)
+        self.end_frame()
+
+    def invalidate(self, regions=None):
+        # Mark regions ('text', 'buttons', 'cover' or 'reflection') of the
+        # cached layers as damaged and only queue their area for redraw.
+        # Without regions all layers are dropped and everything is redrawn.
+        # While suspended nothing is queued, the layers are dropped for
+        # the redraw on resume.
+        if regions is None or self.region_matrix is None or self.suspended:
+            self.graphics = None
+            self.reflection = None
+            self.hover_layers = {}
+            if not self.suspended:
+                self.queue_draw()
+            return
+        for name in regions:
+            self.damage.add(name)
+            self.queue_draw_area(*self.region_area(self.regions[name]))
+            if self.conf['draw_reflection'] and name != 'reflection':
+                self.queue_draw_area(*self.region_area(self.mirror_region(self.regions[name]), self.conf['blur'] + 1))
+
+    def update_regions(self, matrix, width, height, cover_offset):
+        # Logical regions in cover units, the cover area being 1 x 1
+        xx, yx, xy, yy, tx, ty = matrix
+        left, right = -tx / xx, (width - tx) / xx
+        border = self.conf['border']
+        if self.conf['text_position'] in [POSITION_SW, POSITION_NW]:
+            self.regions['text'] = (left, 0, 0, 1)
+        else:
+            self.regions['text'] = (1, 0, right, 1)
+        self.regions['cover'] = (0, 0, 1, 1)
+        self.regions['buttons'] = (border, self.conf['hover_size'] + 2 * border, 1 - border, 1 - border)
+        self.regions['reflection'] = (left, 1, right, height / yy)
+        self.region_matrix = matrix
+        self.cover_offset = cover_offset
+
+    def region_area(self, region, pad=1):
+        # Device rectangle (x, y, width, height) covering a region
+        x0, y0, x1, y1 = region
+        xx, yx, xy, yy, tx, ty = self.region_matrix
+        x = int(math.floor(tx + x0 * xx)) - pad
+        y = int(math.floor(ty + y0 * yy)) - pad
+        return (x, y, int(math.ceil(tx + x1 * xx)) + pad - x, int(math.ceil(ty + y1 * yy)) + pad - y)
+
+    def mirror_region(self, region):
+        x0, y0, x1, y1 = region
+        y = 2.02 + 2 * self.cover_offset
+        return (x0, y - y1, x1, y - y0)
+
+    def get_cover_offset(self, hover=None):
+        # Wide covers are aligned to the top when the text is at the top
+        if hover is None:
+            hover = self.mouse_over
+        if (self.conf['text_position'] in [POSITION_NW, POSITION_NE]) and (not hover):
+            if(self.cover_image.w > self.cover_image.h):
+                return (self.cover_image.h - self.cover_image.w) / self.cover_image.w
+        return 0
 
     def draw(self, cc):
+        self.start_frame()
+        start = time.time()
+
         # Clear cairo context
         cc.set_source_rgba(0, 0, 0, 0)
         cc.set_operator(cairo.OPERATOR_SOURCE)
         cc.paint()
+        self.mark('clear')
 
         # Scale the context so that the cover image area is 1 x 1
         rect = self.get_allocation()
@@ -203,70 +402,19 @@ class DesktopControl(gtk.DrawingArea):
         cc.translate(x_trans, 0)
         cc.scale(cover_area_size, cover_area_size)
 
-        cc.push_group()
-        self.song_info.draw(cc)
-        if self.mouse_over:
-            self.desktop_buttons.draw(cc)
-            cc.save()
-            cc.translate((1 - self.conf['hover_size']) / 2, self.conf['border'])
-            cc.scale(self.conf['hover_size'], self.conf['hover_size'])
-        if (self.conf['text_position'] in [POSITION_NW, POSITION_NE]) and (not self.mouse_over):
-            if(self.cover_image.w > self.cover_image.h):
-                cc.save()
-                cc.translate(0, (self.cover_image.h - self.cover_image.w) / self.cover_image.w)
-        self.cover_image.draw(cc, cover_area_size)
-        if (self.conf['text_position'] in [POSITION_NW, POSITION_NE]) and (not self.mouse_over):
-            if(self.cover_image.w > self.cover_image.h):
-                cc.restore()
-        if self.mouse_over:
-            cc.restore()
-        graphics = cc.pop_group()
-
-        # Draw main graphics
-        cc.set_source(graphics)
-        cc.set_operator(cairo.OPERATOR_OVER)
-        cc.paint()
-
-        # Draw reflections
-        if self.conf['draw_reflection']:
-            cc.save()
-            cc.set_operator(cairo.OPERATOR_ADD)
-            cc.translate(0, 2.02)
-            if (self.conf['text_position'] in [POSITION_NW, POSITION_NE]) and (not self.mouse_over):
-                if(self.cover_image.w > self.cover_image.h):
-                    cc.save()
-                    cc.translate(0, 2 * (self.cover_image.h - self.cover_image.w) / self.cover_image.w)
-            cc.scale(1, -1)
-            cc.push_group()
-            x_scale = cc.get_matrix()[0]
-            r1 = int(self.conf['blur'] / 2 + 1.5)
-            r0 = r1 - self.conf['blur'] - 1
-            bn = (self.conf['blur'] + 1)**2
-            for dx in xrange(r0, r1):
-                for dy in xrange(r0, r1):
-                    cc.save()
-                    cc.translate(dx/x_scale, dy/x_scale)
-                    cc.set_source(graphics)
-                    cc.paint_with_alpha(1/bn)
-                    cc.restore()
-            graphics = cc.pop_group()
-            cc.set_source(graphics)
-            shadow_mask = cairo.LinearGradient(0, 1 - self.conf['reflection_height'], 0, 1)
-            shadow_mask.add_color_stop_rgba(0, 0, 0, 0, 0)
-            shadow_mask.add_color_stop_rgba(1, 0, 0, 0, self.conf['reflection_intensity'])
-            cc.mask(shadow_mask)
-            if (self.conf['text_position'] in [POSITION_NW, POSITION_NE]) and (not self.mouse_over):
-                if(self.cover_image.w > self.cover_image.h):
-                    cc.restore()
-            cc.restore()
+        matrix = cc.get_matrix()
+        cover_offset = self.get_cover_offset()
+        key = (rect.width, rect.height, tuple(matrix), cover_offset)
+        self.mark('layout')
+        if self.hover_transition:
+            self.draw_hover_frame(cc, matrix, cover_area_size, rect.width, rect.height)
+        else:
+            self.draw_layers(cc, matrix, key, cover_offset, cover_area_size, rect.width, rect.height)
 
         # Input mask, only the cover image is clickable
         # Will, (and should) only work if parent is gtk.Window
-        pixmask = gtk.gdk.Pixmap(None, int(cover_area_size), int(cover_area_size), 1)
-        ccmask = pixmask.cairo_create()
-        roundedrec(ccmask, 0, 0, cover_area_size, cover_area_size, self.conf['roundness'])
-        ccmask.fill()
-        self.get_parent().input_shape_combine_mask(pixmask, int(x_trans), 0)
+        self.set_input_mask(int(cover_area_size), int(x_trans))
+        self.mark('input_mask')
 
         # Draw border
         if self.draw_border:
@@ -279,12 +427,245 @@ class DesktopControl(gtk.DrawingArea):
             cc.set_source_rgba(0, 0, 0, 0.35)
             cc.set_dash([10,10], 10)
             cc.stroke()
+        self.mark('border')
+        self.clock.frame_done(1000 * (time.time() - start))
+        self.end_frame()
+
+    def draw_layers(self, cc, matrix, key, cover_offset, cover_area_size, width, height):
+        # The cached graphics layer and its blurred reflection, crossfaded
+        # from the previous song's layers after a song change
+        if self.fade and self.fade[2] != key:
+            self.fade = None
+        if self.graphics is None:
+            # Take over the layers rendered for the end of a hover transition
+            layers = self.hover_layers.get(self.mouse_over)
+            if layers and layers[0][:4] == key:
+                self.update_regions(matrix, width, height, cover_offset)
+                self.graphics, self.reflection = layers[1:]
+                self.graphics_key = key
+                self.reflection_key = layers[0][4:]
+        self.hover_layers = {}
+        if self.graphics is None or key != self.graphics_key:
+            self.update_regions(matrix, width, height, cover_offset)
+            self.graphics = self.render_graphics(None, matrix, cover_area_size, width, height)
+            self.graphics_key = key
+            self.reflection = None
+            self.damage.clear()
+        elif self.damage:
+            # Only render the damaged parts of the layer again
+            clip = [self.region_area(self.regions[name]) for name in self.damage if name != 'reflection']
+            if clip:
+                self.render_graphics(self.graphics, matrix, cover_area_size, width, height, clip)
+            if 'reflection' in self.damage or not self.conf['draw_reflection']:
+                self.reflection = None
+            else:
+                self.patch_reflection(clip, matrix)
+            self.damage.clear()
+        alpha = 1
+        if self.fade:
+            alpha = self.fade[3].progress()
+
+        # Draw main graphics, adding both layers blends them linearly
+        cc.set_operator(alpha < 1 and cairo.OPERATOR_ADD or cairo.OPERATOR_OVER)
+        self.paint_layer(cc, self.graphics, matrix, alpha)
+        if alpha < 1:
+            self.paint_layer(cc, self.fade[0], matrix, 1 - alpha)
+        self.mark('compose')
+
+        # Draw reflections
+        if self.conf['draw_reflection']:
+            blur_key = self.blur_key()
+            if self.reflection is None or blur_key != self.reflection_key:
+                self.reflection = self.blur_layer(self.graphics, matrix, width, blur_key)
+                self.reflection_key = blur_key
+            reflection = cairo.SurfacePattern(self.reflection)
+            reflection.set_matrix(matrix)
+            self.mark('reflection_blur')
+
+            self.draw_reflection(cc, reflection, cover_offset, alpha)
+            if alpha < 1 and self.fade[1]:
+                reflection = cairo.SurfacePattern(self.fade[1])
+                reflection.set_matrix(matrix)
+                self.draw_reflection(cc, reflection, cover_offset, 1 - alpha)
+            self.mark('reflection_mask')
+
+    def blur_key(self):
+        r1 = int(self.conf['blur'] / 2 + 1.5)
+        return (r1 - self.conf['blur'] - 1, r1)
+
+    def blur_layer(self, layer, matrix, width, blur_key):
+        # Blur the rows of the layer that show in the reflection
+        r0, r1 = blur_key
+        if r1 - r0 > 1:
+            top, bottom = self.reflection_rows(matrix, r1 - r0)
+            return box_blur(layer, r0, r1, (0, top, width, bottom))
+        return layer
+
+    def patch_reflection(self, areas, matrix):
+        # Blur the damaged areas of the layer again and copy them into the
+        # cached reflection, skipping what does not show in it
+        if self.reflection is None or self.reflection is self.graphics:
+            return
+        r0, r1 = self.reflection_key
+        pad = r1 - r0
+        top, bottom = self.reflection_rows(matrix, pad)
+        cc = cairo.Context(self.reflection)
+        cc.set_operator(cairo.OPERATOR_SOURCE)
+        for x, y, w, h in areas:
+            rect = (x - pad, max(y - pad, top), x + w + pad, min(y + h + pad, bottom))
+            if rect[1] >= rect[3]:
+                continue
+            cc.rectangle(rect[0], rect[1], rect[2] - rect[0], rect[3] - rect[1])
+            cc.set_source_surface(box_blur(self.graphics, r0, r1, rect), 0, 0)
+            cc.fill()
+
+    def reflection_rows(self, matrix, pad):
+        # Device rows of the layer that show in the reflection, cover units
+        # 1 - reflection_height to 1, padded by the blur size
+        yy, ty = matrix[3], matrix[5]
+        return (int(math.floor(ty + yy * (1 - self.conf['reflection_height']))) - pad,
+                int(math.ceil(ty + yy)) + pad)
+
+    def paint_layer(self, cc, layer, matrix, alpha):
+        pattern = cairo.SurfacePattern(layer)
+        pattern.set_matrix(matrix)
+        cc.set_source(pattern)
+        cc.paint_with_alpha(alpha)
+
+    def draw_reflection(self, cc, pattern, cover_offset, alpha=1):
+        # Mirror the pattern below the cover, fading it out downwards
+        cc.save()
+        cc.set_operator(cairo.OPERATOR_ADD)
+        cc.translate(0, 2.02 + 2 * cover_offset)
+        cc.scale(1, -1)
+        cc.set_source(pattern)
+        shadow_mask = cairo.LinearGradient(0, 1 - self.conf['reflection_height'], 0, 1)
+        shadow_mask.add_color_stop_rgba(0, 0, 0, 0, 0)
+        shadow_mask.add_color_stop_rgba(1, 0, 0, 0, alpha * self.conf['reflection_intensity'])
+        cc.mask(shadow_mask)
+        cc.restore()
 
-    def set_song(self, playing=False, cover_image=None, song_info=None):
-        self.cover_image.set_image(cover_image)
+    def draw_hover_frame(self, cc, matrix, cover_area_size, width, height):
+        # One frame of the hover transition, composed from the cached text
+        # surface, button sprites and cover tile. The reflection crossfades
+        # between the blurred reflections of both ends of the transition.
+        t = self.get_hover_value()
+        cover_offset = self.get_cover_offset(False) * (1 - t)
+        size = 1 + (self.conf['hover_size'] - 1) * t
+        cc.push_group()
+        self.song_info.draw(cc)
+        self.mark('song_text')
+        if t > 0:
+            cc.push_group()
+            self.desktop_buttons.draw(cc)
+            cc.pop_group_to_source()
+            cc.paint_with_alpha(t)
+            self.mark('buttons')
+        cc.save()
+        cc.translate((1 - size) / 2, self.conf['border'] * t + cover_offset)
+        cc.scale(size, size)
+        # The tile is kept at full size and scaled while drawing
+        self.cover_image.draw(cc, cover_area_size, int(cover_area_size + 0.5))
+        cc.restore()
+        self.mark('cover')
+        frame = cc.pop_group()
+        cc.set_source(frame)
+        cc.paint()
+        self.mark('compose')
+        if self.conf['draw_reflection']:
+            for hover, alpha in ((False, 1 - t), (True, t)):
+                if alpha > 0:
+                    reflection = cairo.SurfacePattern(self.get_hover_layers(hover, matrix, cover_area_size, width, height)[2])
+                    reflection.set_matrix(matrix)
+                    self.draw_reflection(cc, reflection, self.get_cover_offset(hover), alpha)
+            self.mark('reflection_mask')
+
+    def get_hover_layers(self, hover, matrix, cover_area_size, width, height):
+        # Graphics layer and blurred reflection with or without hover,
+        # rendered once per transition
+        key = (width, height, tuple(matrix), self.get_cover_offset(hover)) + self.blur_key()
+        layers = self.hover_layers.get(hover)
+        if layers is None or layers[0] != key:
+            graphics = self.render_graphics(None, matrix, cover_area_size, width, height, hover=hover)
+            layers = (key, graphics, self.blur_layer(graphics, matrix, width, key[4:]))
+            self.hover_layers[hover] = layers
+            self.mark('reflection_blur')
+        return layers
+
+    def set_input_mask(self, size, x_trans):
+        # Shaping the window is a round trip to the X server, so only do it
+        # when the geometry of the mask has changed
+        geometry = (size, x_trans, self.conf['roundness'])
+        parent = self.get_parent()
+        if geometry == self.input_mask_geometry and parent is self.input_mask_parent:
+            return
+        pixmask = gtk.gdk.Pixmap(None, size, size, 1)
+        ccmask = pixmask.cairo_create()
+        roundedrec(ccmask, 0, 0, size, size, self.conf['roundness'])
+        ccmask.fill()
+        parent.input_shape_combine_mask(pixmask, x_trans, 0)
+        self.input_mask_geometry = geometry
+        self.input_mask_parent = parent
+
+    def get_input_mask_geometry(self):
+        # (size, x offset, roundness) of the last applied input mask
+        return self.input_mask_geometry
+
+    def render_graphics(self, layer, matrix, cover_area_size, width, height, clip=None, hover=None):
+        # Song info, buttons and cover, rendered in device space so the
+        # reflection can be blurred directly on the pixels. With clip, only
+        # those device rectangles of an existing layer are rendered again.
+        if hover is None:
+            hover = self.mouse_over
+        if layer is None:
+            layer = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+        cc = gtk.gdk.CairoContext(cairo.Context(layer))
+        if clip:
+            for area in clip:
+                cc.rectangle(*area)
+            cc.clip()
+            cc.set_operator(cairo.OPERATOR_CLEAR)
+            cc.paint()
+            cc.set_operator(cairo.OPERATOR_OVER)
+        cc.set_matrix(matrix)
+
+        self.song_info.draw(cc)
+        self.mark('song_text')
+        if hover:
+            self.desktop_buttons.draw(cc)
+            self.mark('buttons')
+            cc.save()
+            cc.translate((1 - self.conf['hover_size']) / 2, self.conf['border'])
+            cc.scale(self.conf['hover_size'], self.conf['hover_size'])
+        cover_offset = self.get_cover_offset(hover)
+        if cover_offset:
+            cc.save()
+            cc.translate(0, cover_offset)
+        self.cover_image.draw(cc, cover_area_size)
+        self.mark('cover')
+        if cover_offset:
+            cc.restore()
+        if hover:
+            cc.restore()
+        return layer
+
+    def set_song(self, playing=False, cover_image=None, song_info=None, decoded=None):
+        cover_offset = self.get_cover_offset()
+        old_image = self.cover_image.get_current_image()
+        old_text = self.song_info.text
+        self.cover_image.set_image(cover_image, decoded)
         self.song_info.set_text(song_info)
         self.desktop_buttons.set_playing(playing)
-        self.queue_draw()
+        changed = old_image != self.cover_image.get_current_image() or old_text != self.song_info.text
+        if changed and self.graphics is not None and self.animated(self.conf['crossfade_duration']):
+            # Crossfade from the current layers to new ones
+            self.fade = (self.graphics, self.reflection, self.graphics_key, Transition(self.conf['crossfade_duration']))
+            self.clock.start()
+            self.invalidate()
+        elif cover_offset != self.get_cover_offset():
+            self.invalidate()
+        else:
+            self.invalidate(['text', 'cover', 'buttons'])
 
     def set_draw_border(self, val=False):
         self.draw_border = val
@@ -296,15 +677,19 @@ class SongInfo():
             'album'  : ['', '']}
     font = gconf.client_get_default().get_string('/apps/nautilus/preferences/desktop_font')
 
-    def __init__(self, song_info=None):
+    def __init__(self, config, song_info=None):
+        self.layout = None
+        self.layout_key = None
+        self.surface = None
+        self.surface_key = None
         self.set_text(song_info)
 
         self.gconf_keys = ['border', 'text_position', 'text_color', 'text_shadow_color']
-        self.conf = {}
-        read_gconf_values(self.conf, self.gconf_keys)
+        self.conf = config
 
     def font_changed(self, font):
         self.font = font
+        self.surface = None
 
     def set_text(self, song_info):
         self.text = ''
@@ -313,6 +698,45 @@ class SongInfo():
                 if song_info[key]:
                     self.text += '%s%s%s\n' % (self.tags[key][0], song_info[key].replace('&', '&amp;'), self.tags[key][1])
             self.text = self.text[:-1]
+        self.surface = None
+
+    def get_layout(self):
+        if self.conf['text_position'] in [POSITION_SW, POSITION_NW]:
+            alignment = pango.ALIGN_RIGHT
+        else:
+            alignment = pango.ALIGN_LEFT
+        key = (self.text, self.font, alignment)
+        if self.layout is None or key != self.layout_key:
+            cc = gtk.gdk.CairoContext(cairo.Context(cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1)))
+            self.layout = cc.create_layout()
+            self.layout.set_markup(self.text)
+            self.layout.set_font_description(pango.FontDescription(self.font))
+            self.layout.set_alignment(alignment)
+            self.layout_key = key
+        return self.layout
+
+    def get_surface(self):
+        # Text and its shadow rasterized together, the shadow offset by (1, 1)
+        layout = self.get_layout()
+        key = (self.layout_key, self.conf['text_color'], self.conf['text_shadow_color'])
+        if self.surface is None or key != self.surface_key:
+            ink, logical = layout.get_pixel_extents()
+            x0 = min(ink[0], logical[0])
+            y0 = min(ink[1], logical[1])
+            x1 = max(ink[0] + ink[2], logical[0] + logical[2]) + 1
+            y1 = max(ink[1] + ink[3], logical[1] + logical[3]) + 1
+            self.surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, max(1, x1 - x0), max(1, y1 - y0))
+            self.surface_origin = (x0, y0)
+            cc = gtk.gdk.CairoContext(cairo.Context(self.surface))
+            cc.update_layout(layout)
+            cc.translate(1 - x0, 1 - y0)
+            cc.set_source_rgba(self.conf['text_shadow_color_r'], self.conf['text_shadow_color_g'], self.conf['text_shadow_color_b'], self.conf['text_shadow_color_a'])
+            cc.show_layout(layout)
+            cc.translate(-1, -1)
+            cc.set_source_rgba(self.conf['text_color_r'], self.conf['text_color_g'], self.conf['text_color_b'], self.conf['text_color_a'])
+            cc.show_layout(layout)
+            self.surface_key = key
+        return self.surface
 
     def draw(self, cc):
         if self.text:
@@ -320,47 +744,38 @@ class SongInfo():
             x_scale = cc.get_matrix()[0]
             x_trans = cc.get_matrix()[4]
             cc.identity_matrix()
-            layout = cc.create_layout()
-            layout.set_markup(self.text)
-            layout.set_font_description(pango.FontDescription(self.font))
-            txw, txh = layout.get_size()
+            surface = self.get_surface()
+            txw, txh = self.layout.get_size()
             if self.conf['text_position'] in [POSITION_SW, POSITION_NW]:
                 x_trans = x_trans - txw / pango.SCALE - x_scale * self.conf['border']
-                layout.set_alignment(pango.ALIGN_RIGHT)
             else:
                 x_trans = x_trans + x_scale * (1 + self.conf['border'])
-                layout.set_alignment(pango.ALIGN_LEFT)
             if self.conf['text_position'] in [POSITION_NE, POSITION_NW]:
                 y_trans = x_scale * self.conf['border'] / 2
             else:
                 y_trans = x_scale * (1 - self.conf['border'] / 2) - txh / pango.SCALE
-            cc.translate(x_trans, y_trans)
-            # Draw text shadow
-            cc.translate(1,1)
-            cc.set_source_rgba(self.conf['text_shadow_color_r'], self.conf['text_shadow_color_g'], self.conf['text_shadow_color_b'], self.conf['text_shadow_color_a'])
-            cc.show_layout(layout)
-            # Draw text
-            cc.translate(-1,-1)
-            cc.set_source_rgba(self.conf['text_color_r'], self.conf['text_color_g'], self.conf['text_color_b'], self.conf['text_color_a'])
-            cc.show_layout(layout)
+            cc.set_source_surface(surface, round(x_trans) + self.surface_origin[0], round(y_trans) + self.surface_origin[1])
+            cc.paint()
             cc.restore()
 
 class DesktopButtons():
     icon_keys = ['previous', 'play', 'next']
+    icon_states = ['normal', 'hover', 'playing']
 
-    def __init__(self, icons, player):
+    def __init__(self, icons, player, config):
         self.icons = icons
         self.player = player
+        self.sprites = None
+        self.sprites_key = None
         self.idata = {}
         for k in self.icon_keys:
-            self.idata[(k, 'cairo_path')] = None
+            self.idata[(k, 'rect')] = None
             self.idata[(k, 'hover')] = False
         self.icon_theme_changed(gtk.icon_theme_get_default())
         self.playing = player.get_playing()
 
         self.gconf_keys = ['roundness', 'hover_size', 'border', 'background_color']
-        self.conf = {}
-        read_gconf_values(self.conf, self.gconf_keys)
+        self.conf = config
 
     def set_playing(self, playing):
         self.playing = playing
@@ -377,19 +792,21 @@ class DesktopButtons():
             return True
         return False
 
-    def set_mouse_position(self, w, x, y):
+    def set_mouse_position(self, x, y):
         redraw = False
         for k in self.icon_keys:
-            if self.idata[(k, 'cairo_path')]:
-                cc = w.window.cairo_create()
-                cc.append_path(self.idata[(k, 'cairo_path')])
-                hover = cc.in_fill(x,y)
+            if self.idata[(k, 'rect')]:
+                # The button is drawn as a unit rounded rectangle scaled to
+                # w x h, so test in those units
+                x0, y0, w, h, r = self.idata[(k, 'rect')]
+                hover = w > 0 and h > 0 and in_roundedrec((x - x0) / w, (y - y0) / h, 0, 0, 1, 1, r)
                 if hover != self.idata[(k, 'hover')]:
                     self.idata[(k, 'hover')] = hover
                     redraw = True
         return redraw
 
     def icon_theme_changed(self, icon_theme):
+        self.sprites = None
         for k in self.icon_keys:
             self.idata[(k, 'icon_path')] = get_icon_path(icon_theme, self.icons[k], self.icons['size'])
             try:
@@ -426,26 +843,60 @@ class DesktopButtons():
         cc.restore()
 
     def draw_icon(self, cc, key, w, h, hover):
-        cc.save()
-
         cc.save()
         cc.scale(w, h)
-        roundedrec(cc, 0, 0, 1, 1, self.conf['roundness'])
 
-        cc.save()
-        cc.identity_matrix()
-        self.idata[(key, 'cairo_path')] = cc.copy_path()
-        cc.restore()
+        # Button rectangle in device space, for hit testing
+        x0, y0 = cc.user_to_device(0, 0)
+        x1, y1 = cc.user_to_device(1, 1)
+        self.idata[(key, 'rect')] = (x0, y0, x1 - x0, y1 - y0, self.conf['roundness'])
 
         if hover:
-            cc.set_source_rgba(1, 1, 1, 0.3)
+            state = 'hover'
+        elif self.playing and key == 'play':
+            state = 'playing'
         else:
-            if self.playing and key == 'play':
-                cc.set_source_rgba(0, 0, 0, 1)
-            else:
-                cc.set_source_rgba(0, 0, 0, 0.3)
+            state = 'normal'
+        pw = max(1, int(round(x1 - x0)))
+        ph = max(1, int(round(y1 - y0)))
+        sprites = self.get_sprites(pw, ph)
+        cc.scale(1 / pw, 1 / ph)
+        cc.set_source_surface(sprites, -self.icon_states.index(state) * pw, -self.icon_keys.index(key) * ph)
+        cc.rectangle(0, 0, pw, ph)
         cc.fill()
+        cc.restore()
+
+    def get_sprites(self, pw, ph):
+        # Every button in every state, rasterized once for a pixel size.
+        # Rows are buttons and columns are states.
+        key = (pw, ph, self.conf['roundness'], self.conf['border'])
+        if self.sprites is None or key != self.sprites_key:
+            self.sprites = cairo.ImageSurface(cairo.FORMAT_ARGB32, len(self.icon_states) * pw, len(self.icon_keys) * ph)
+            cc = gtk.gdk.CairoContext(cairo.Context(self.sprites))
+            for row, k in enumerate(self.icon_keys):
+                for col, state in enumerate(self.icon_states):
+                    cc.save()
+                    cc.translate(col * pw, row * ph)
+                    cc.rectangle(0, 0, pw, ph)
+                    cc.clip()
+                    self.render_icon(cc, k, pw, ph, state)
+                    cc.restore()
+            self.sprites_key = key
+        return self.sprites
+
+    def render_icon(self, cc, key, w, h, state):
+        cc.save()
 
+        cc.save()
+        cc.scale(w, h)
+        roundedrec(cc, 0, 0, 1, 1, self.conf['roundness'])
+        if state == 'hover':
+            cc.set_source_rgba(1, 1, 1, 0.3)
+        elif state == 'playing':
+            cc.set_source_rgba(0, 0, 0, 1)
+        else:
+            cc.set_source_rgba(0, 0, 0, 0.3)
+        cc.fill()
         cc.restore()
 
         x = max(0, (w-h)/2)
@@ -472,13 +923,18 @@ class DesktopButtons():
         cc.fill()
 
 class CoverImage():
-    def __init__(self, icons):
+    def __init__(self, icons, config):
         self.icons = icons
-        self.icon_theme_changed(gtk.icon_theme_get_default())
+        self.tile = None
+        self.tile_key = None
 
-        self.gconf_keys = ['roundness', 'background_color']
-        self.conf = {}
-        read_gconf_values(self.conf, self.gconf_keys)
+        self.gconf_keys = ['roundness', 'background_color', 'scale_cache_kb', 'image_cache_kb']
+        self.conf = config
+        self.scaled_images = LRUCache(self.conf['scale_cache_kb'] * 1024, pixbuf_size)
+        self.decoded_images = LRUCache(self.conf['image_cache_kb'] * 1024, lambda value: value[1])
+        self.image_keys = LRUCache(256)
+
+        self.icon_theme_changed(gtk.icon_theme_get_default())
 
     def icon_theme_changed(self, icon_theme):
         not_playing_image = get_icon_path(icon_theme, self.icons['not_playing'], self.icons['size'])
@@ -495,33 +951,116 @@ class CoverImage():
         if image != False:
             self.set_image(image)
 
-    def set_image(self, image=None):
+    def set_image(self, image=None, decoded=None):
         if not image:
             image = self.get_not_playing_image()
         if image == UNKNOWN_COVER:
             image = self.get_unknown_cover_image()
         if not image:
-            self.draw = self.draw_background
+            self.paint = self.draw_background
+            self.operator = None
+            self.tile_rect = (0, 0, 1, 1)
         else:
-            try:
-                self.image = rsvg.Handle(file=image)
-                self.w = self.image.props.width
-                self.h = self.image.props.height
-                self.draw = self.draw_svg
-            except:
-                try:
-                    self.image = gtk.gdk.pixbuf_new_from_file(image)
-                    self.w = self.image.get_width()
-                    self.h = self.image.get_height()
-                    self.draw = self.draw_pixbuf
-                except:
-                    pass
+            decoded = decoded or self.get_decoded(image)
+            self.image_key = self.image_keys.get(image) or image_key(image)
+            if decoded:
+                self.image, self.w, self.h, is_svg = decoded
+                if is_svg:
+                    self.paint = self.draw_svg
+                    self.operator = None
+                else:
+                    self.paint = self.draw_pixbuf
+                    self.operator = cairo.OPERATOR_SOURCE
 
             self.dim = max(self.w, self.h)
             self.x = (self.dim - self.w) / 2
             self.y = self.dim - self.h
             self.scale = 1 / self.dim
+            self.tile_rect = (self.x * self.scale, self.y * self.scale, self.w * self.scale, self.h * self.scale)
         self.current_image = image
+        self.tile = None
+
+    def set_cache_sizes(self):
+        self.scaled_images.set_max_size(self.conf['scale_cache_kb'] * 1024)
+        self.decoded_images.set_max_size(self.conf['image_cache_kb'] * 1024)
+
+    def get_decoded(self, file_name):
+        # load_image through an LRU cache keyed by (path, mtime, size),
+        # bounded by the estimated size of the decoded images. Safe to call
+        # from worker threads.
+        key = image_key(file_name)
+        if key is None:
+            return None
+        self.image_keys.put(file_name, key)
+        value = self.decoded_images.get(key)
+        if value is None:
+            decoded = load_image(file_name)
+            if decoded is None:
+                return None
+            if decoded[3]:
+                value = (decoded, key[2])
+            else:
+                value = (decoded, pixbuf_size(decoded[0]))
+            self.decoded_images.put(key, value)
+        return value[0]
+
+    def get_scaled(self, image_key, image, w, h, size):
+        # Pixbuf scaled to fit size x size, through the scaled image cache
+        img_scale = size / max(w, h)
+        key = (image_key, int(w * img_scale + 1.5), int(h * img_scale + 1.5))
+        scaled_image = self.scaled_images.get(key)
+        if scaled_image is None:
+            scaled_image = image.scale_simple(key[1], key[2], gtk.gdk.INTERP_TILES)
+            self.scaled_images.put(key, scaled_image)
+        return scaled_image
+
+    def prefetch(self, file_name):
+        # Decode an image and scale it to the current cover size ahead of
+        # time, returning the number of bytes it takes. Safe to call from
+        # worker threads.
+        decoded = self.get_decoded(file_name)
+        key = self.image_keys.get(file_name)
+        if not decoded or not key:
+            return 0
+        if decoded[3]:
+            return key[2]
+        size = pixbuf_size(decoded[0])
+        if self.tile_key:
+            size += pixbuf_size(self.get_scaled(key, decoded[0], decoded[1], decoded[2], self.tile_key[0]))
+        return size
+
+    def get_stats(self):
+        return {'decoded': self.decoded_images.get_stats(),
+                'scaled': self.scaled_images.get_stats()}
+
+    def draw(self, cc, size = None, px = None):
+        # Blit a pre-rendered, rounded and background filled tile of the
+        # cover, only rebuilding it when its pixel size or look changes.
+        # Without px the tile matches the device size of the cover.
+        if px is None:
+            px = max(1, int(cc.get_matrix()[0] + 0.5))
+        key = (px, self.conf['roundness'], self.conf['background_color'])
+        if self.tile is None or key != self.tile_key:
+            self.tile = self.render_tile(px)
+            self.tile_key = key
+        cc.save()
+        cc.scale(1/px, 1/px)
+        cc.set_source_surface(self.tile, 0, 0)
+        if self.operator is None:
+            cc.paint()
+        else:
+            cc.set_operator(self.operator)
+            x, y, w, h = self.tile_rect
+            roundedrec(cc, x * px, y * px, w * px, h * px, self.conf['roundness'])
+            cc.fill()
+        cc.restore()
+
+    def render_tile(self, px):
+        tile = cairo.ImageSurface(cairo.FORMAT_ARGB32, px, px)
+        tc = gtk.gdk.CairoContext(cairo.Context(tile))
+        tc.scale(px, px)
+        self.paint(tc, px)
+        return tile
 
     def draw_background(self, cc, size = None):
         cc.save()
@@ -546,7 +1085,7 @@ class CoverImage():
 
     def draw_pixbuf(self, cc, size = None):
         img_scale = size/self.dim
-        scaled_image = self.image.scale_simple(int(self.w * img_scale + 1.5), int(self.h * img_scale + 1.5), gtk.gdk.INTERP_TILES)
+        scaled_image = self.get_scaled(self.image_key, self.image, self.w, self.h, size)
         cc.save()
         cc.set_operator(cairo.OPERATOR_SOURCE)
         cc.scale(self.scale, self.scale)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the Rhythmbox Desktop Art plug-in
+#
+# Copyright © 2008 Mathias Nedrebø < mathias at nedrebo dot org >
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+from __future__ import division
+
+import time
+import gobject
+
+class Transition():
+    # Eased progress from 0 to 1 over duration ms
+    def __init__(self, duration):
+        self.duration = duration
+        self.start = time.time()
+
+    def progress(self):
+        if self.duration <= 0:
+            return 1
+        t = min(1, 1000 * (time.time() - self.start) / self.duration)
+        return t * t * (3 - 2 * t)
+
+    def done(self):
+        return self.progress() >= 1
+
+class FrameClock():
+    # Calls tick() at up to fps frames a second while it returns True.
+    # frame_done(ms) reports each drawn frame. While a frame is still
+    # waiting to be drawn, or for as many intervals as the last frame took,
+    # ticks are dropped instead of queueing more frames. Transitions are
+    # timed, so dropping frames does not slow them down.
+    def __init__(self, fps, tick):
+        self.tick = tick
+        self.source = None
+        self.pending = None
+        self.skip = 0
+        self.frames = 0
+        self.dropped = 0
+        self.set_fps(fps)
+
+    def set_fps(self, fps):
+        self.fps = fps
+        self.interval = fps > 0 and 1000 / fps or 0
+        if self.source:
+            self.stop()
+            self.start()
+
+    def start(self):
+        if not self.source and self.fps > 0:
+            self.source = gobject.timeout_add(int(self.interval), self.timeout)
+
+    def stop(self):
+        if self.source:
+            gobject.source_remove(self.source)
+            self.source = None
+        self.pending = None
+        self.skip = 0
+
+    def timeout(self):
+        # A frame that was never drawn, e.g. while the window is hidden,
+        # only holds the clock for a few intervals
+        now = time.time()
+        waiting = self.pending and 1000 * (now - self.pending) < 4 * self.interval
+        if waiting or self.skip:
+            self.skip = max(0, self.skip - 1)
+            self.dropped += 1
+            return True
+        self.pending = now
+        self.frames += 1
+        if not self.tick():
+            self.source = None
+            self.pending = None
+            return False
+        return True
+
+    def frame_done(self, ms):
+        if self.pending:
+            self.pending = None
+            self.skip = int(ms // self.interval)
+
+    def get_stats(self):
+        return {'frames': self.frames, 'dropped': self.dropped}
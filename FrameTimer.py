@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the Rhythmbox Desktop Art plug-in
+#
+# Copyright © 2008 Mathias Nedrebø < mathias at nedrebo dot org >
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+from __future__ import division
+
+import time
+from collections import deque
+
+class FrameTimer():
+    # Times the stages of each frame, keeping the last `window` samples of
+    # every stage to report percentiles, and counts frames over budget.
+    # Times are in milliseconds.
+    def __init__(self, stages, budget, log_interval=0, window=500):
+        self.stages = stages
+        self.budget = budget
+        self.log_interval = log_interval
+        self.samples = dict((s, deque(maxlen=window)) for s in stages + ['frame'])
+        self.frames = 0
+        self.over_budget = 0
+        self.depth = 0
+        self.last_log = time.time()
+
+    def start_frame(self):
+        # Frames can nest, e.g. expose calling draw, only the outer one counts
+        self.depth += 1
+        if self.depth == 1:
+            self.frame_start = self.stage_start = time.time()
+            self.current = {}
+
+    def mark(self, stage):
+        # End the current stage, started at the previous mark
+        if self.depth:
+            now = time.time()
+            self.current[stage] = self.current.get(stage, 0) + 1000 * (now - self.stage_start)
+            self.stage_start = now
+
+    def end_frame(self):
+        self.depth -= 1
+        if self.depth:
+            return
+        now = time.time()
+        total = 1000 * (now - self.frame_start)
+        for stage in self.stages:
+            self.samples[stage].append(self.current.get(stage, 0))
+        self.samples['frame'].append(total)
+        self.frames += 1
+        if total > self.budget:
+            self.over_budget += 1
+        if self.log_interval and now - self.last_log >= self.log_interval:
+            self.last_log = now
+            print self.format_stats()
+
+    def percentile(self, stage, p):
+        samples = sorted(self.samples[stage])
+        if not samples:
+            return 0
+        return samples[int(round(p / 100 * (len(samples) - 1)))]
+
+    def get_stats(self):
+        stats = {'frames': self.frames, 'over_budget': self.over_budget, 'budget': self.budget}
+        for stage in self.stages + ['frame']:
+            stats[stage] = {'p50': self.percentile(stage, 50),
+                            'p95': self.percentile(stage, 95),
+                            'p99': self.percentile(stage, 99)}
+        return stats
+
+    def format_stats(self):
+        stats = self.get_stats()
+        parts = ['%s %.1f/%.1f/%.1f' % (s, stats[s]['p50'], stats[s]['p95'], stats[s]['p99'])
+                 for s in ['frame'] + self.stages]
+        return 'Desktop Art frame times p50/p95/p99 ms: %s; %d of %d frames over %.1f ms' % \
+               (', '.join(parts), self.over_budget, self.frames, self.budget)
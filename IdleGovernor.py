@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the Rhythmbox Desktop Art plug-in
+#
+# Copyright © 2008 Mathias Nedrebø < mathias at nedrebo dot org >
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+from __future__ import division
+
+import gobject
+
+from IdleTimer import IdleTimer
+
+class IdleGovernor():
+    # Calls suspend() once the session has been idle for idle_timeout
+    # seconds or the screensaver is on, and resume() when there is activity
+    # again. While active the next check is timed for when the timeout can
+    # first be reached, while idle the session is checked every idle_poll
+    # seconds. An idle_timeout of 0 turns it off.
+    def __init__(self, config, suspend, resume):
+        self.conf = config
+        self.suspend = suspend
+        self.resume = resume
+        self.idle = False
+        self.source = None
+        self.closed = False
+        try:
+            self.idle_timer = IdleTimer()
+        except (OSError, KeyError, AttributeError), e:
+            print 'Desktop Art idle detection disabled: %s' % e
+            self.idle_timer = None
+        self.conf.subscribe(['idle_timeout', 'idle_poll'], self.conf_changed)
+        self.schedule(0)
+
+    def conf_changed(self, keys):
+        self.schedule(0)
+
+    def schedule(self, delay):
+        if self.source:
+            gobject.source_remove(self.source)
+        self.source = gobject.timeout_add(max(int(1000 * delay), 100), self.check)
+
+    def check(self):
+        self.source = None
+        if self.closed:
+            return False
+        timeout = self.conf['idle_timeout']
+        if not self.idle_timer or timeout <= 0:
+            self.set_idle(False)
+            return False
+        idle_time = self.idle_timer.getIdleTime() / 1000
+        self.set_idle(idle_time >= timeout or self.idle_timer.isScreenSaverActive())
+        if self.idle:
+            self.schedule(self.conf['idle_poll'])
+        else:
+            self.schedule(timeout - idle_time)
+        return False
+
+    def set_idle(self, idle):
+        if idle != self.idle:
+            self.idle = idle
+            if idle:
+                self.suspend()
+            else:
+                self.resume()
+
+    def close(self):
+        self.closed = True
+        self.conf.unsubscribe(self.conf_changed)
+        if self.source:
+            gobject.source_remove(self.source)
+            self.source = None
+        if self.idle_timer:
+            self.idle_timer.close()
+            self.idle_timer = None
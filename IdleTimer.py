@@ -25,6 +25,9 @@
 
 import ctypes
 import os
+import time
+
+SCREEN_SAVER_ON = 1
 
 class XScreenSaverInfo(ctypes.Structure):
   _fields_ = [('window',      ctypes.c_ulong), # screen saver window
@@ -35,17 +38,36 @@ class XScreenSaverInfo(ctypes.Structure):
               ('event_mask',  ctypes.c_ulong)] # events
   
 class IdleTimer():
-  def __init__(self):
+  # The X server is asked at most once every min_interval ms, in between
+  # the idle time is extrapolated from the last answer
+  def __init__(self, min_interval=1000):
     self.xlib = ctypes.cdll.LoadLibrary('libX11.so')
     self.dpy = self.xlib.XOpenDisplay(os.environ['DISPLAY'])
     self.root = self.xlib.XDefaultRootWindow(self.dpy)
     self.xss = ctypes.cdll.LoadLibrary('libXss.so')
     self.xss.XScreenSaverAllocInfo.restype = ctypes.POINTER(XScreenSaverInfo)
     self.xss_info = self.xss.XScreenSaverAllocInfo()
+    self.min_interval = min_interval
+    self.last_query = None
+
+  def query(self):
+    now = time.time()
+    if self.last_query is None or 1000 * (now - self.last_query) >= self.min_interval:
+      self.xss.XScreenSaverQueryInfo(self.dpy, self.root, self.xss_info)
+      self.last_query = now
+    return now
 
   def getIdleTime(self):
-    self.xss.XScreenSaverQueryInfo(self.dpy, self.root, self.xss_info)
-    return self.xss_info.contents.idle
+    now = self.query()
+    return self.xss_info.contents.idle + int(1000 * (now - self.last_query))
+
+  def isScreenSaverActive(self):
+    self.query()
+    return self.xss_info.contents.state == SCREEN_SAVER_ON
+
+  def close(self):
+    self.xlib.XFree(self.xss_info)
+    self.xlib.XCloseDisplay(self.dpy)
 
 if __name__== '__main__':
   it = IdleTimer()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the Rhythmbox Desktop Art plug-in
+#
+# Copyright © 2008 Mathias Nedrebø < mathias at nedrebo dot org >
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import threading
+from collections import OrderedDict
+
+def pixbuf_size(pixbuf):
+    return pixbuf.get_rowstride() * pixbuf.get_height()
+
+class LRUCache():
+    # Least recently used cache, bounded by the total size of its values.
+    # Without size_of every value counts as 1, bounding the number of items.
+    # Safe to share with worker threads.
+    def __init__(self, max_size, size_of=None):
+        self.max_size = max_size
+        self.size_of = size_of or (lambda value: 1)
+        self.lock = threading.RLock()
+        self.items = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None, valid=None):
+        # A value failing the optional valid(value) check is dropped and
+        # counts as a miss
+        with self.lock:
+            return self._get(key, default, valid)
+
+    def _get(self, key, default, valid):
+        try:
+            item = self.items.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        if valid and not valid(item[0]):
+            self.size -= item[1]
+            self.misses += 1
+            return default
+        self.items[key] = item
+        self.hits += 1
+        return item[0]
+
+    def put(self, key, value):
+        size = self.size_of(value)
+        with self.lock:
+            self.discard(key)
+            if size <= self.max_size:
+                self.items[key] = (value, size)
+                self.size += size
+                self.shrink()
+
+    def discard(self, key):
+        with self.lock:
+            item = self.items.pop(key, None)
+            if item:
+                self.size -= item[1]
+
+    def set_max_size(self, max_size):
+        with self.lock:
+            if max_size != self.max_size:
+                self.max_size = max_size
+                self.shrink()
+
+    def shrink(self):
+        with self.lock:
+            while self.size > self.max_size:
+                self.size -= self.items.popitem(last=False)[1][1]
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return lookups and self.hits / float(lookups)
+
+    def get_stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate(),
+                    'items': len(self.items), 'size': self.size}
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
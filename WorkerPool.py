@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the Rhythmbox Desktop Art plug-in
+#
+# Copyright © 2008 Mathias Nedrebø < mathias at nedrebo dot org >
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import itertools
+import threading
+import traceback
+import Queue
+import gobject
+
+PRIORITY_HIGH = 0
+PRIORITY_LOW = 10
+
+class WorkerPool():
+    # A fixed number of daemon threads running jobs off the main loop.
+    # Results are handed back on the main loop with gobject.idle_add.
+    # Lower priority values run first.
+    def __init__(self, workers):
+        gobject.threads_init()
+        self.jobs = Queue.PriorityQueue()
+        self.counter = itertools.count()
+        self.threads = []
+        for i in xrange(workers):
+            thread = threading.Thread(target=self.run)
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, fn, args=(), callback=None, cb_args=(), priority=PRIORITY_HIGH):
+        # Run fn(*args) on a worker, then callback(result, *cb_args) on the
+        # main loop. The result is None if fn raised.
+        self.jobs.put((priority, self.counter.next(), fn, args, callback, cb_args))
+
+    def run(self):
+        while True:
+            priority, n, fn, args, callback, cb_args = self.jobs.get()
+            if fn is None:
+                return
+            try:
+                result = fn(*args)
+            except Exception:
+                traceback.print_exc()
+                result = None
+            if callback:
+                gobject.idle_add(self.deliver, callback, result, cb_args)
+
+    def deliver(self, callback, result, cb_args):
+        callback(result, *cb_args)
+        return False
+
+    def stop(self):
+        # Let the workers finish their current job and exit
+        for thread in self.threads:
+            self.jobs.put((PRIORITY_LOW + 1, self.counter.next(), None, (), None, ()))
+        self.threads = []
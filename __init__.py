@@ -25,8 +25,10 @@ import time
 import gobject
 
 from DesktopControl import DesktopControl
+from Config import Config
 from CoverManager import CoverManager
-from ConfigDialog import ConfigDialog
+from CoverScheduler import CoverScheduler
+from IdleGovernor import IdleGovernor
 import DefaultGConfValues
 
 icons = {'previous'      : 'gtk-media-previous-ltr',
@@ -38,23 +40,31 @@ icons = {'previous'      : 'gtk-media-previous-ltr',
 
 gconf_plugin_path = '/apps/rhythmbox/plugins/desktop-art'
 POLL_TIMEOUT = 1000
+POLL_MAX_TIMEOUT = 64000
+POLL_RETRIES = 8
 
 class DesktopArt(rb.Plugin):
     def __init__ (self):
         rb.Plugin.__init__ (self)
 
     def activate (self, shell):
-        window =  gtk.glade.XML(self.find_file('desktop-art.glade')).get_widget('window')
-        self.composited = window.is_composited()
+        # The context menu and preferences dialog are built on first use,
+        # everything here is needed for the first frame
+        marks = [('start', time.time())]
+        self.composited = gtk.gdk.screen_get_default().is_composited()
         if self.composited:
+            window =  gtk.glade.XML(self.find_file('desktop-art.glade')).get_widget('window')
             player = shell.get_player()
+            marks.append(('window', time.time()))
 
-            desktop_control = DesktopControl(icons, shell, player, self.find_file('configure-art.glade'))
-            cover_manager = CoverManager(player.props.db)
-            player.props.db.connect_after("entry-extra-metadata-notify::rb:coverArt-uri", self.notify_metadata)
-
-            gc = gconf.client_get_default()
-            window_props = self.get_gconf_window_props(gc)
+            config = Config(gconf_plugin_path)
+            marks.append(('config', time.time()))
+            desktop_control = DesktopControl(icons, shell, player, self.find_file('configure-art.glade'), config)
+            marks.append(('desktop_control', time.time()))
+            cover_manager = CoverManager(player.props.db, config, desktop_control.cover_image.get_decoded, desktop_control.cover_image.prefetch)
+            self.cover_scheduler = CoverScheduler(cover_manager, self.set_song, POLL_TIMEOUT, POLL_MAX_TIMEOUT, POLL_RETRIES)
+            self.metadata_cb = player.props.db.connect_after("entry-extra-metadata-notify::rb:coverArt-uri", self.notify_metadata)
+            marks.append(('cover_manager', time.time()))
 
             window.set_colormap(window.get_screen().get_rgba_colormap())
             window.stick()
@@ -62,27 +72,27 @@ class DesktopArt(rb.Plugin):
             window.add(desktop_control)
             window
 
-            self.gc_notify_ids = [gc.notify_add(self.gconf_path('window_x'), self.gconf_cb, window_props),
-                                  gc.notify_add(self.gconf_path('window_y'), self.gconf_cb, window_props),
-                                  gc.notify_add(self.gconf_path('window_w'), self.gconf_cb, window_props),
-                                  gc.notify_add(self.gconf_path('window_h'), self.gconf_cb, window_props)]
-
-            self.player = player
-            self.cb = player.connect('playing-changed', self.playing_changed, desktop_control, cover_manager)
-            self.playing_changed(player, player.get_playing(), desktop_control, cover_manager)
+            # Moving and resizing writes all four keys, they arrive as one change
+            config.subscribe(['window_x', 'window_y', 'window_w', 'window_h'], self.window_props_changed)
 
-            self.gc = gc
+            self.config = config
             self.window = window
-            self.window_props = window_props
             self.desktop_control = desktop_control
             self.cover_manager = cover_manager
 
-            print "Adding timeout"
-            ret = gobject.timeout_add(POLL_TIMEOUT, self.poll_for_coverart)
-            print "integer id returned: " + str(ret)
+            self.shell = shell
+            self.player = player
+            self.prefetched_entry = None
+            self.idle = False
+            self.cb = player.connect('playing-changed', self.playing_changed)
+            self.playing_changed(player, player.get_playing())
+            marks.append(('song', time.time()))
 
-            self.position_window(self.window_props)
+            self.position_window()
             self.window.show_all()
+            marks.append(('show', time.time()))
+            self.idle_governor = IdleGovernor(config, self.suspend, self.resume)
+            self.report_startup(marks)
         else:
             # We don't have compisiting
             md = gtk.MessageDialog(type=gtk.MESSAGE_ERROR,
@@ -93,61 +103,78 @@ class DesktopArt(rb.Plugin):
 
     def deactivate(self, shell):
         if self.composited:
-            for i in self.gc_notify_ids:
-                self.gc.notify_remove(i)
-            self.set_gconf_window_props(self.gc, self.window)
+            self.idle_governor.close()
+            self.config.unsubscribe(self.window_props_changed)
+            self.set_gconf_window_props(self.window)
+            self.desktop_control.close()
             self.window.destroy()
             self.player.disconnect(self.cb)
+            self.player.props.db.disconnect(self.metadata_cb)
+            self.cover_scheduler.cancel()
+            self.cover_manager.close()
+            self.config.close()
             del self.desktop_control
             del self.cover_manager
+            del self.cover_scheduler
+            del self.metadata_cb
             del self.window
-            del self.gc
+            del self.config
             del self.cb
             del self.player
-            del self.gc_notify_ids
+            del self.shell
+            del self.prefetched_entry
+            del self.idle_governor
+            del self.idle
         del self.composited
 
+    def report_startup(self, marks):
+        # Where activation time went, printed along with frame timing
+        if self.config['frame_timing']:
+            parts = ['%s %.1f' % (marks[i][0], 1000 * (marks[i][1] - marks[i - 1][1])) for i in range(1, len(marks))]
+            print 'Desktop Art activation ms: defaults %.1f, %s; total %.1f' % \
+                  (1000 * DefaultGConfValues.init_time, ', '.join(parts), 1000 * (marks[-1][1] - marks[0][1]))
+
     def create_configure_dialog(self, dialog=None):
         if not dialog:
+            from ConfigDialog import ConfigDialog
             dialog =  ConfigDialog(self.find_file('configure-art.glade'), gconf_plugin_path, self.desktop_control)
             dialog.present()
         return dialog
 
-    # Add the poll object for new track
-    def playing_changed(self, player, playing, desktop_control, cover_manager):
-        gobject.timeout_add(POLL_TIMEOUT, self.poll_for_coverart)
-        c, s = cover_manager.get_cover_and_song_info(player.get_playing_entry())
-        desktop_control.set_song(playing, c, s)
-
-    # An ugly poll method which repeatedly wastes system resources
-    def poll_for_coverart(self):
-        print "Polling for coverart"
-        c, s = self.cover_manager.get_cover_and_song_info(self.player.get_playing_entry())
-        print "Cover art found: " + str(c)
-        if c==-1 or c is None:
-            return True
-        else:
-            self.desktop_control.set_song(self.player.get_playing(), c, s)
-            return False          
-
-    # Subscribe to metadata notification
-    # TODO: Not working - notification coming too soon
+    def playing_changed(self, player, playing):
+        entry = player.get_playing_entry()
+        self.cover_scheduler.set_entry(entry)
+        if entry != self.prefetched_entry and not self.idle:
+            self.prefetched_entry = entry
+            self.cover_manager.prefetch(self.shell, player, entry)
+
+    def suspend(self):
+        self.idle = True
+        self.cover_scheduler.suspend()
+        self.desktop_control.set_suspended(True)
+
+    def resume(self):
+        self.idle = False
+        self.desktop_control.set_suspended(False)
+        self.cover_scheduler.resume()
+        entry = self.player.get_playing_entry()
+        if entry != self.prefetched_entry:
+            self.prefetched_entry = entry
+            self.cover_manager.prefetch(self.shell, self.player, entry)
+
+    def set_song(self, cover, song_info, image):
+        self.desktop_control.set_song(self.player.get_playing(), cover, song_info, image)
+
+    # The notification can come before the cover is saved, the scheduler
+    # keeps retrying with backoff in that case
     def notify_metadata(self, db, entry, field=None,metadata=None):
-        print "Metadata changed changed"
-        if entry:
-            c, s = self.cover_manager.get_cover_and_song_info(entry)
-            self.desktop_control.set_song(self.player.get_playing(), c, s)
+        self.cover_scheduler.notify(entry)
 
     def gconf_path(self, key):
         return '%s/%s' % (gconf_plugin_path, key)
 
-    def get_gconf_window_props(self, gc):
-        return {'x' : gc.get_int(self.gconf_path('window_x')),
-                'y' : gc.get_int(self.gconf_path('window_y')),
-                'w' : gc.get_int(self.gconf_path('window_w')),
-                'h' : gc.get_int(self.gconf_path('window_h'))}
-
-    def set_gconf_window_props(self, gc, window):
+    def set_gconf_window_props(self, window):
+        gc = gconf.client_get_default()
         x, y = window.get_position()
         w, h = window.get_size()
         gc.set_int(self.gconf_path('window_x'), x)
@@ -155,11 +182,9 @@ class DesktopArt(rb.Plugin):
         gc.set_int(self.gconf_path('window_w'), w)
         gc.set_int(self.gconf_path('window_h'), h)
 
-    def gconf_cb(self, client, cnxn_id, entry, wp):
-        k = entry.get_key().split('_')[-1]
-        wp[k] = entry.get_value().get_int()
-        self.position_window(wp)
+    def window_props_changed(self, keys):
+        self.position_window()
 
-    def position_window(self, wp):
-        self.window.resize(wp['w'], wp['h'])
-        self.window.move(wp['x'], wp['y'])
+    def position_window(self):
+        self.window.resize(self.config['window_w'], self.config['window_h'])
+        self.window.move(self.config['window_x'], self.config['window_y'])
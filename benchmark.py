@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the Rhythmbox Desktop Art plug-in
+#
+# Copyright © 2008 Mathias Nedrebø < mathias at nedrebo dot org >
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+#
+# Headless rendering benchmark. Stubs out gtk, gconf, gobject, rb and
+# rhythmdb, so that only pycairo is needed (pangocairo and rsvg are used
+# when available), and renders DesktopControl and its parts into an
+# offscreen image surface. Results are written as one JSON object per line.
+#
+#   python benchmark.py [-n FRAMES] [-o FILE] [--quick]
+#
+
+from __future__ import division
+
+import gc
+import json
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+import cairo
+
+try:
+    import pango, pangocairo
+except ImportError:
+    pango = pangocairo = None
+
+try:
+    import rsvg
+except ImportError:
+    rsvg = None
+
+SIZES = [(400, 190), (800, 300), (1600, 600)]
+BLURS = [0, 1, 5, 10]
+REFLECTIONS = [False, True]
+HOVERS = [False, True]
+COVERS = ['raster', 'svg']
+
+stats = {'surfaces': 0}
+
+# Stub modules
+
+class _Stub(object):
+    # Accepts any call and attribute access
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _Stub()
+
+    def __call__(self, *args, **kwargs):
+        return _Stub()
+
+    def __iter__(self):
+        return iter([])
+
+class _Rectangle(object):
+    def __init__(self, x=0, y=0, width=0, height=0):
+        self.x, self.y, self.width, self.height = x, y, width, height
+
+class _Pixbuf(object):
+    # Just enough of a gtk.gdk.Pixbuf, backed by an image surface
+    def __init__(self, surface):
+        self.surface = surface
+
+    def get_width(self):
+        return self.surface.get_width()
+
+    def get_height(self):
+        return self.surface.get_height()
+
+    def get_rowstride(self):
+        return self.surface.get_stride()
+
+    def scale_simple(self, w, h, interp):
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
+        cc = cairo.Context(surface)
+        cc.scale(w / self.get_width(), h / self.get_height())
+        cc.set_source_surface(self.surface, 0, 0)
+        cc.paint()
+        return _Pixbuf(surface)
+
+if pangocairo:
+    class _CairoContext(pangocairo.CairoContext):
+        def set_source_pixbuf(self, pixbuf, x, y):
+            self.set_source_surface(pixbuf.surface, x, y)
+else:
+    class _CairoContext(object):
+        # A cairo.Context can't be made from another context, so wrap it
+        def __init__(self, cc):
+            self.cc = cc
+
+        def __getattr__(self, name):
+            return getattr(self.cc, name)
+
+        def set_source_pixbuf(self, pixbuf, x, y):
+            self.cc.set_source_surface(pixbuf.surface, x, y)
+
+class _Pixmap(object):
+    def __init__(self, drawable, w, h, depth):
+        self.surface = cairo.ImageSurface(cairo.FORMAT_A1, max(1, w), max(1, h))
+
+    def cairo_create(self):
+        return cairo.Context(self.surface)
+
+class _IconInfo(object):
+    def __init__(self, filename):
+        self.filename = filename
+
+    def get_filename(self):
+        return self.filename
+
+class _IconTheme(_Stub):
+    icon_dir = None
+
+    def lookup_icon(self, name, size, flags):
+        return _IconInfo(os.path.join(self.icon_dir, '%s.png' % name))
+
+class _Window(_Stub):
+    def __init__(self):
+        self.shape_calls = 0
+
+    def input_shape_combine_mask(self, mask, x, y):
+        self.shape_calls += 1
+
+class _DrawingArea(_Stub):
+    def __init__(self):
+        self.allocation = _Rectangle()
+        self.parent = _Window()
+        self.queued = 0
+
+    def get_allocation(self):
+        return self.allocation
+
+    def get_parent(self):
+        return self.parent
+
+    def queue_draw(self):
+        self.queued += 1
+
+    def queue_draw_area(self, x, y, w, h):
+        self.queued += 1
+
+class _GConfValue(object):
+    def __init__(self, value):
+        self.value = value
+        if isinstance(value, bool):
+            self.type = gconf.VALUE_BOOL
+        elif isinstance(value, int):
+            self.type = gconf.VALUE_INT
+        elif isinstance(value, float):
+            self.type = gconf.VALUE_FLOAT
+        else:
+            self.type = gconf.VALUE_STRING
+
+    def get_bool(self):
+        return self.value
+    get_int = get_float = get_string = get_bool
+
+class _GConfClient(_Stub):
+    values = {'/apps/nautilus/preferences/desktop_font': 'Sans 10'}
+
+    def get_without_default(self, key):
+        if key.replace('//', '/') in self.values:
+            return _GConfValue(self.values[key.replace('//', '/')])
+        return None
+
+    def get_string(self, key):
+        return self.values.get(key.replace('//', '/'))
+    get_int = get_float = get_bool = get_string
+
+    def set_string(self, key, value):
+        self.values[key.replace('//', '/')] = value
+    set_int = set_float = set_bool = set_string
+
+    def all_entries(self, path):
+        prefix = path.rstrip('/') + '/'
+        return [_GConfEntry(k, _GConfValue(v)) for k, v in self.values.items()
+                if k.startswith(prefix) and '/' not in k[len(prefix):]]
+
+class _GConfEntry(object):
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+
+    def get_key(self):
+        return self.key
+
+    def get_value(self):
+        return self.value
+
+    def get_is_default(self):
+        return False
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+def install_stubs(icon_dir):
+    global gconf, _client
+    _client = _GConfClient()
+    gconf = _module('gconf', VALUE_FLOAT=1, VALUE_INT=2, VALUE_STRING=3, VALUE_BOOL=4,
+                    CLIENT_PRELOAD_NONE=0, CLIENT_PRELOAD_ONELEVEL=1,
+                    client_get_default=lambda: _client)
+    _IconTheme.icon_dir = icon_dir
+    theme = _IconTheme()
+    gdk = _module('gtk.gdk',
+                  CairoContext=_CairoContext, Pixmap=_Pixmap, Rectangle=_Rectangle,
+                  pixbuf_new_from_file=lambda f: _Pixbuf(cairo.ImageSurface.create_from_png(f)),
+                  screen_width=lambda: 1600, screen_height=lambda: 1200,
+                  INTERP_TILES=0, ENTER_NOTIFY=1, LEAVE_NOTIFY=2,
+                  ENTER_NOTIFY_MASK=1, LEAVE_NOTIFY_MASK=2, POINTER_MOTION_MASK=4,
+                  POINTER_MOTION_HINT_MASK=8, BUTTON_PRESS_MASK=16)
+    glade = _module('gtk.glade', XML=_Stub)
+    stub_classes = dict((name, type(name, (_Stub,), {})) for name in
+                        ['Menu', 'CheckMenuItem', 'ImageMenuItem', 'SeparatorMenuItem', 'Dialog',
+                         'SpinButton', 'RadioButton', 'CheckButton', 'ColorButton'])
+    _module('gtk', gdk=gdk, glade=glade, DrawingArea=_DrawingArea,
+            icon_theme_get_default=lambda: theme, ICON_LOOKUP_FORCE_SVG=0,
+            STOCK_PREFERENCES='gtk-preferences', STOCK_OK='gtk-ok', RESPONSE_ACCEPT=-3,
+            **stub_classes)
+    _module('gobject', idle_add=lambda *a, **k: 1, timeout_add=lambda *a, **k: 1,
+            source_remove=lambda source: True, PRIORITY_HIGH_IDLE=100,
+            PRIORITY_DEFAULT_IDLE=200, PRIORITY_LOW=300)
+    if not rsvg:
+        _module('rsvg', Handle=lambda file=None: _raise(IOError(file)))
+    if not pango:
+        _module('pango', SCALE=1024, ALIGN_LEFT=0, ALIGN_RIGHT=2, FontDescription=_Stub)
+    _module('rb', Plugin=_Stub)
+    _module('rhythmdb', PROP_TITLE=0, PROP_ARTIST=1, PROP_ALBUM=2)
+
+    # Count image surfaces created by the plugin
+    try:
+        class CountingImageSurface(cairo.ImageSurface):
+            def __new__(cls, *args):
+                stats['surfaces'] += 1
+                return _ImageSurface(*args)
+        cairo.ImageSurface = CountingImageSurface
+    except TypeError:
+        stats['surfaces'] = None
+
+_ImageSurface = cairo.ImageSurface
+
+def _raise(e):
+    raise e
+
+# Test images
+
+def write_images(icon_dir):
+    def png(name, w, h, color):
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
+        cc = cairo.Context(surface)
+        cc.set_source_rgba(*color)
+        cc.paint()
+        cc.set_source_rgba(1, 1, 1, 0.5)
+        cc.arc(w / 2, h / 2, min(w, h) / 3, 0, 6.3)
+        cc.fill()
+        path = os.path.join(icon_dir, '%s.png' % name)
+        surface.write_to_png(path)
+        return path
+
+    for name in ['gtk-media-previous-ltr', 'gtk-media-play-ltr', 'gtk-media-next-ltr',
+                 'rhythmbox-notplaying', 'rhythmbox']:
+        png(name, 48, 48, (0.2, 0.2, 0.2, 1))
+    covers = {'raster': png('cover', 600, 600, (0.6, 0.1, 0.1, 1))}
+    if rsvg:
+        covers['svg'] = os.path.join(icon_dir, 'cover.svg')
+        f = open(covers['svg'], 'w')
+        f.write('<svg xmlns="http://www.w3.org/2000/svg" width="600" height="600">'
+                '<rect width="600" height="600" fill="#226"/>'
+                '<circle cx="300" cy="300" r="200" fill="#fff" fill-opacity="0.5"/></svg>')
+        f.close()
+    return covers
+
+# Blur check
+
+def check_blur():
+    # The NumPy blur against the cairo one on random pixels. They may
+    # differ by the rounding of the hi - lo copies cairo adds in each
+    # direction, a wrong offset is far off on noise.
+    import boxblur
+    numpy = boxblur.numpy
+    if not numpy:
+        sys.stderr.write('numpy not available, skipping the blur check\n')
+        return
+    w, h = 64, 48
+    random = numpy.random.RandomState(0)
+    alpha = random.randint(0, 256, (h, w, 1))
+    color = random.randint(0, 256, (h, w, 3)) * alpha // 255
+    pixels = sys.byteorder == 'little' and (color, alpha) or (alpha, color)
+    data = numpy.concatenate(pixels, 2).astype(numpy.uint8).reshape(h, w * 4)
+    surface = _ImageSurface.create_for_data(data, cairo.FORMAT_ARGB32, w, h, w * 4)
+
+    failures = []
+    for lo, hi in [(0, 2), (-2, 4), (-5, 6)]:
+        for rect in [None, (0, 10, w, 30), (-3, 5, 40, h + 3)]:
+            blurred = _pixels(boxblur.box_blur(surface, lo, hi, rect), numpy)
+            boxblur.numpy = None
+            try:
+                expected = _pixels(boxblur.box_blur(surface, lo, hi, rect), numpy)
+            finally:
+                boxblur.numpy = numpy
+            diff = abs(blurred - expected).max()
+            if diff > hi - lo:
+                failures.append('lo=%d hi=%d rect=%s: off by %d' % (lo, hi, rect, diff))
+    if failures:
+        sys.exit('NumPy blur does not match cairo:\n  %s' % '\n  '.join(failures))
+
+def _pixels(surface, numpy):
+    surface.flush()
+    w, h, stride = surface.get_width(), surface.get_height(), surface.get_stride()
+    data = numpy.frombuffer(surface.get_data(), numpy.uint8).reshape(h, stride)
+    return data[:, :w * 4].astype(int)
+
+# Benchmark
+
+class _Player(_Stub):
+    def get_playing(self):
+        return True
+
+def measure(fn, frames):
+    gc.collect()
+    surfaces = stats['surfaces']
+    objects = len(gc.get_objects())
+    start = time.time()
+    for i in xrange(frames):
+        fn()
+    elapsed = time.time() - start
+    result = {'ms_per_frame': 1000 * elapsed / frames,
+              'objects_per_frame': (len(gc.get_objects()) - objects) / frames}
+    if surfaces is not None:
+        result['surfaces_per_frame'] = (stats['surfaces'] - surfaces) / frames
+    return result
+
+def run_case(DesktopControl, Config, icons, cover, size, blur, reflection, hover, frames):
+    _client.set_int('/apps/rhythmbox/plugins/desktop-art/blur', blur)
+    _client.set_bool('/apps/rhythmbox/plugins/desktop-art/draw_reflection', reflection)
+    dc = DesktopControl.DesktopControl(icons, _Stub(), _Player(), None,
+                                       Config.Config(DesktopControl.gconf_plugin_path))
+    dc.allocation = _Rectangle(0, 0, size[0], size[1])
+    dc.mouse_over = hover
+    song = {'title': 'Title', 'artist': 'Artist', 'album': 'Album'}
+    dc.set_song(True, cover, pangocairo and song)
+
+    target = cairo.ImageSurface(cairo.FORMAT_ARGB32, size[0], size[1])
+    def context():
+        return _CairoContext(cairo.Context(target))
+    def cold():
+        dc.invalidate()
+        dc.cover_image.tile = None
+        dc.cover_image.scaled_images.clear()
+        dc.song_info.surface = None
+        dc.desktop_buttons.sprites = None
+        dc.draw(context())
+    def warm():
+        dc.draw(context())
+    def unit():
+        cc = context()
+        cc.scale(size[1], size[1])
+        return cc
+
+    result = {'cover': cover.endswith('.svg') and 'svg' or 'raster',
+              'width': size[0], 'height': size[1], 'blur': blur,
+              'reflection': reflection, 'hover': hover}
+    warm()
+    for name, fn in [('draw_cold', cold), ('draw_warm', warm),
+                     ('song_info', lambda: dc.song_info.draw(unit())),
+                     ('buttons', lambda: dc.desktop_buttons.draw(unit())),
+                     ('cover', lambda: dc.cover_image.draw(unit(), size[1])),
+                     ('cover_paint', lambda: dc.cover_image.paint(unit(), size[1]))]:
+        for k, v in measure(fn, frames).items():
+            result['%s_%s' % (name, k)] = round(v, 3)
+    return result
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-n', '--frames', type='int', default=10, help='frames per measurement')
+    parser.add_option('-o', '--output', help='write results to FILE instead of stdout')
+    parser.add_option('--quick', action='store_true', help='only the smallest and largest size')
+    options, args = parser.parse_args()
+
+    icon_dir = tempfile.mkdtemp(prefix='desktop-art-bench-')
+    try:
+        install_stubs(icon_dir)
+        covers = write_images(icon_dir)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        check_blur()
+        import DefaultGConfValues
+        import DesktopControl
+        import Config
+        icons = {'previous': 'gtk-media-previous-ltr', 'play': 'gtk-media-play-ltr',
+                 'next': 'gtk-media-next-ltr', 'not_playing': 'rhythmbox-notplaying',
+                 'unknown_cover': 'rhythmbox', 'size': 500}
+
+        out = options.output and open(options.output, 'w') or sys.stdout
+        sizes = options.quick and [SIZES[0], SIZES[-1]] or SIZES
+        for cover in COVERS:
+            if cover not in covers:
+                sys.stderr.write('rsvg not available, skipping %s covers\n' % cover)
+                continue
+            for size in sizes:
+                for blur in BLURS:
+                    for reflection in REFLECTIONS:
+                        for hover in HOVERS:
+                            result = run_case(DesktopControl, Config, icons, covers[cover], size,
+                                              blur, reflection, hover, options.frames)
+                            result['text'] = bool(pangocairo)
+                            out.write('%s\n' % json.dumps(result, sort_keys=True))
+                            out.flush()
+    finally:
+        shutil.rmtree(icon_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the Rhythmbox Desktop Art plug-in
+#
+# Copyright © 2008 Mathias Nedrebø < mathias at nedrebo dot org >
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+#
+# Separable box blur for ARGB32 image surfaces. The result is the same as
+# painting the surface shifted by every (dx, dy) with lo <= dx, dy < hi
+# and alpha 1 / (hi - lo)^2. With NumPy it is computed with running sums,
+# so the cost does not depend on the size of the box. Otherwise cairo
+# paints the shifted copies, one pass per direction.
+#
+
+from __future__ import division
+
+import cairo
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def box_blur(surface, lo, hi, rect=None):
+    # Only the pixels in rect, (x0, y0, x1, y1), of the result are
+    # blurred, the rest is left clear
+    surface.flush()
+    w = surface.get_width()
+    h = surface.get_height()
+    x0, y0, x1, y1 = rect or (0, 0, w, h)
+    x0, y0, x1, y1 = max(0, x0), max(0, y0), min(w, x1), min(h, y1)
+    if x0 >= x1 or y0 >= y1:
+        return cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
+    # Source pixels the blurred ones depend on
+    src = (max(0, x0 - hi + 1), max(0, y0 - hi + 1), min(w, x1 - lo), min(h, y1 - lo))
+    if numpy:
+        stride = surface.get_stride()
+        data = _blur_numpy(surface.get_data(), w, h, stride, lo, hi, (x0, y0, x1, y1), src)
+        return cairo.ImageSurface.create_for_data(data, cairo.FORMAT_ARGB32, w, h, stride)
+    return _blur_cairo(surface, w, h, lo, hi, (x0, y0, x1, y1), src)
+
+def _box_numpy(a, axis, lo, hi):
+    n = a.shape[axis]
+    shape = list(a.shape)
+    shape[axis] = 1
+    sums = numpy.concatenate((numpy.zeros(shape, numpy.uint32),
+                              numpy.cumsum(a, axis=axis, dtype=numpy.uint32)), axis)
+    x = numpy.arange(n)
+    start = numpy.clip(x - hi + 1, 0, n)
+    end = numpy.clip(x - lo + 1, 0, n)
+    return sums.take(end, axis) - sums.take(start, axis)
+
+def _blur_numpy(data, w, h, stride, lo, hi, rect, src):
+    n = (hi - lo)**2
+    x0, y0, x1, y1 = rect
+    sx0, sy0, sx1, sy1 = src
+    pixels = numpy.frombuffer(data, numpy.uint8).reshape(h, stride)[:, :w * 4].reshape(h, w, 4)[sy0:sy1, sx0:sx1]
+    sums = _box_numpy(_box_numpy(pixels, 1, lo, hi), 0, lo, hi)[y0 - sy0:y1 - sy0, x0 - sx0:x1 - sx0]
+    out = numpy.zeros((h, stride), numpy.uint8)
+    out[y0:y1, x0 * 4:x1 * 4] = ((sums + n // 2) // n).reshape(y1 - y0, (x1 - x0) * 4)
+    return out
+
+def _blur_cairo(surface, w, h, lo, hi, rect, src):
+    # Adding the shifted copies at 1 / (hi - lo) each, rows then columns
+    alpha = 1 / (hi - lo)
+    x0, y0, x1, y1 = rect
+    rows = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
+    cc = cairo.Context(rows)
+    cc.rectangle(x0, src[1], x1 - x0, src[3] - src[1])
+    cc.clip()
+    cc.set_operator(cairo.OPERATOR_ADD)
+    for d in xrange(lo, hi):
+        cc.set_source_surface(surface, d, 0)
+        cc.paint_with_alpha(alpha)
+    out = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
+    cc = cairo.Context(out)
+    cc.rectangle(x0, y0, x1 - x0, y1 - y0)
+    cc.clip()
+    cc.set_operator(cairo.OPERATOR_ADD)
+    for d in xrange(lo, hi):
+        cc.set_source_surface(rows, 0, d)
+        cc.paint_with_alpha(alpha)
+    return out
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the Rhythmbox Desktop Art plug-in
+#
+# Copyright © 2008 Mathias Nedrebø < mathias at nedrebo dot org >
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+#
+# Resolves the cover of every album in a library ahead of time and stores
+# the results in the plugin's cover database, so the plugin finds them
+# without scanning. Runs outside Rhythmbox. The library is either an
+# exported rhythmdb.xml or a music directory, whose tracks are tagged with
+# mutagen when available and else named by their Artist/Album directories.
+#
+#   python prescan.py [-j JOBS] [--db FILE] (rhythmdb.xml | MUSIC_DIR)
+#
+
+from __future__ import division
+
+import multiprocessing
+import optparse
+import os
+import sys
+import time
+
+from os import path
+from xml.etree import cElementTree
+
+from CoverIndex import DirectoryIndex, CoverCacheIndex, CoverDatabase, normalize_key, track_dir
+from CoverIndex import IMAGE_NAMES, COVER_CACHE_DIRS, COVER_TYPES, COVER_DB
+
+try:
+    import mutagen
+except ImportError:
+    mutagen = None
+
+try:
+    import gtk
+except (ImportError, RuntimeError):
+    gtk = None
+
+AUDIO_TYPES = ['mp3', 'ogg', 'oga', 'flac', 'm4a', 'mp4', 'wma', 'wav', 'mpc', 'ape', 'opus']
+SOURCES = ['database', 'directory', 'cache', 'missing', 'failed']
+DIR_INDEX_SIZE = 1024
+
+def read_rhythmdb(file_name):
+    for event, elem in cElementTree.iterparse(file_name):
+        if elem.tag == 'entry':
+            if elem.get('type') == 'song':
+                yield (elem.findtext('artist') or '', elem.findtext('album') or '',
+                       track_dir(elem.findtext('location') or ''))
+            elem.clear()
+
+def read_music_dir(music_dir):
+    # Absolute like the track directories the plugin looks up
+    for dir_name, dirs, files in os.walk(path.abspath(music_dir)):
+        for f in files:
+            if path.splitext(f)[1][1:].lower() in AUDIO_TYPES:
+                artist, album = read_tags(path.join(dir_name, f))
+                yield (artist, album, dir_name)
+
+def read_tags(file_name):
+    if mutagen:
+        try:
+            tags = mutagen.File(file_name, easy=True)
+            if tags:
+                return (tags.get('artist', [''])[0], tags.get('album', [''])[0])
+        except Exception:
+            pass
+    album_dir = path.dirname(file_name)
+    return (path.basename(path.dirname(album_dir)), path.basename(album_dir))
+
+def get_albums(tracks):
+    # One lookup per album and directory, like the plugin does
+    albums = {}
+    for artist, album, cover_dir in tracks:
+        key = (normalize_key(artist, album), cover_dir)
+        if key not in albums:
+            albums[key] = (artist, album)
+    return [(k[0], k[1], v[0], v[1]) for k, v in albums.iteritems()]
+
+def init_worker():
+    global dir_index, cache_index
+    dir_index = DirectoryIndex(IMAGE_NAMES, DIR_INDEX_SIZE)
+    cache_index = CoverCacheIndex(COVER_CACHE_DIRS, COVER_TYPES)
+
+def resolve(album_info):
+    key, cover_dir, artist, album = album_info
+    try:
+        cover_file = dir_index.find_cover(cover_dir)
+        source = 'directory'
+        if not cover_file:
+            cover_file = cache_index.find_cover(artist, album)
+            source = 'cache'
+        if not cover_file:
+            return (key, cover_dir, 'missing', None, None)
+        if not valid_image(cover_file):
+            return (key, cover_dir, 'failed', cover_file, 'not a readable image')
+        return (key, cover_dir, source, cover_file, None)
+    except Exception, e:
+        return (key, cover_dir, 'failed', None, str(e))
+
+def valid_image(file_name):
+    if gtk:
+        return gtk.gdk.pixbuf_get_file_info(file_name) is not None
+    return path.getsize(file_name) > 0
+
+def prescan(albums, cover_db, jobs):
+    counts = dict((s, 0) for s in SOURCES)
+    failures = []
+    # Albums already in the database only cost a stat
+    todo = []
+    for album_info in albums:
+        if cover_db.lookup(album_info[0], album_info[1]):
+            counts['database'] += 1
+        else:
+            todo.append(album_info)
+
+    pool = multiprocessing.Pool(jobs, init_worker)
+    try:
+        for key, cover_dir, source, cover_file, error in pool.imap_unordered(resolve, todo, 16):
+            counts[source] += 1
+            if error:
+                failures.append((cover_dir, cover_file, error))
+            elif cover_file:
+                cover_db.store(key, cover_dir, cover_file)
+    finally:
+        pool.close()
+        pool.join()
+    return counts, failures
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] (rhythmdb.xml | MUSIC_DIR)')
+    parser.add_option('-j', '--jobs', type='int', default=multiprocessing.cpu_count(),
+                      help='worker processes')
+    parser.add_option('--db', default=COVER_DB, help='cover database to fill')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('expected a rhythmdb.xml file or a music directory')
+
+    start = time.time()
+    if path.isdir(args[0]):
+        albums = get_albums(read_music_dir(args[0]))
+    else:
+        albums = get_albums(read_rhythmdb(args[0]))
+    read_time = time.time() - start
+
+    cover_db = CoverDatabase(path.expanduser(options.db), batch_size=500)
+    start = time.time()
+    counts, failures = prescan(albums, cover_db, max(1, options.jobs))
+    cover_db.close()
+    elapsed = time.time() - start
+
+    total = len(albums)
+    print '%d albums read in %.1f s, resolved in %.1f s (%.0f albums/s)' % \
+          (total, read_time, elapsed, total / max(elapsed, 1e-6))
+    for source in SOURCES:
+        print '  %-10s %6d  %5.1f%%' % (source, counts[source], 100 * counts[source] / max(total, 1))
+    for cover_dir, cover_file, error in failures:
+        print >> sys.stderr, 'failed: %s: %s (%s)' % (cover_dir, cover_file or '-', error)
+    return failures and 1 or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
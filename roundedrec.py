@@ -12,3 +12,18 @@ def roundedrec(cc, x, y, w, h, r):
     cc.curve_to(x,y+h,x,y+h,x,y+h-r)
     cc.line_to(x,y+r)
     cc.curve_to(x,y,x,y,x+r,y)
+
+def in_roundedrec(px, py, x, y, w, h, r):
+    # Hit test matching the path drawn by roundedrec, in the user space it
+    # was drawn in. Each corner curve is
+    # (1-t)^3 * (r, 0) + t^3 * (0, r) seen from the corner, which is the
+    # curve (dx/r)^(1/3) + (dy/r)^(1/3) = 1.
+    if px < x or py < y or px > x+w or py > y+h:
+        return False
+    r = min(1,r)
+    r = r * 0.7 * min(w, h)
+    dx = min(px-x, x+w-px)
+    dy = min(py-y, y+h-py)
+    if r <= 0 or dx >= r or dy >= r:
+        return True
+    return (dx/r)**(1/3) + (dy/r)**(1/3) >= 1